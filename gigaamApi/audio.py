@@ -0,0 +1,265 @@
+import asyncio
+import hashlib
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Optional, Union
+
+import av
+import httpx
+import torch
+
+from .config import AUDIO_DECODER, DECODE_CONCURRENCY, DOWNLOAD_TIMEOUT
+from .metrics import DOWNLOAD_BYTES, STAGE_SECONDS, timed
+
+SAMPLE_RATE = 16000
+CHUNK_SIZE = 1 << 16
+# What ffmpeg says when -vn leaves nothing to write, i.e. the input has no audio
+NO_OUTPUT_STREAM = "does not contain any stream"
+
+http_client = httpx.AsyncClient(follow_redirects=True, timeout=DOWNLOAD_TIMEOUT)
+_decode_slots = asyncio.Semaphore(DECODE_CONCURRENCY)
+# Threads of the in-process decoder, one per pipeline allowed to run
+_decoder_pool = ThreadPoolExecutor(max_workers=DECODE_CONCURRENCY, thread_name_prefix="decode")
+
+
+class NoAudioTrack(ValueError):
+    """The video has no audio stream; retrying the decode would not help."""
+
+
+async def _ffmpeg(source: str) -> asyncio.subprocess.Process:
+    # Decode the first audio track to raw 16 kHz mono float32 on stdout
+    return await asyncio.create_subprocess_exec(
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin",
+        "-i", source,
+        "-vn", "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "f32le", "pipe:1",
+        stdin=asyncio.subprocess.PIPE if source == "pipe:0" else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+
+
+async def _feed(chunks: AsyncIterator[bytes], stdin: asyncio.StreamWriter) -> float:
+    started = time.perf_counter()
+    try:
+        async for chunk in chunks:
+            DOWNLOAD_BYTES.inc(len(chunk))
+            stdin.write(chunk)
+            await stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        # ffmpeg exited early, its exit code tells why
+        pass
+    finally:
+        stdin.close()
+        finished = time.perf_counter()
+        STAGE_SECONDS.observe(finished - started, stage="download")
+    return finished
+
+
+async def _collect(stream: asyncio.StreamReader) -> bytearray:
+    sink = bytearray()
+    while chunk := await stream.read(CHUNK_SIZE):
+        sink += chunk
+    return sink
+
+
+async def _decode(
+    proc: asyncio.subprocess.Process, chunks: Optional[AsyncIterator[bytes]] = None
+) -> tuple[bytearray, int, str]:
+    started = time.perf_counter()
+    pending = [_collect(proc.stdout), _collect(proc.stderr)]
+    if chunks is not None:
+        pending.append(_feed(chunks, proc.stdin))
+
+    pcm, errors, *fed = await asyncio.gather(*pending)
+    returncode = await proc.wait()
+    # Decoding overlaps the download, only what is left after the last byte counts as decode time
+    STAGE_SECONDS.observe(time.perf_counter() - (fed[0] if fed else started), stage="decode")
+    return pcm, returncode, errors.decode(errors="replace").strip()
+
+
+class _ChunkReader:
+    """
+    Blocking, non-seekable file object over chunks put by the event loop, read by PyAV on a
+    decoder thread. Once the decoder has stopped reading, put() tells the feeder to stop.
+
+    When the decoder is behind the download, put() waits on the loop for it to take a chunk: the
+    decoder thread signals every chunk it takes, and closing, with call_soon_threadsafe, so no
+    thread is held while waiting.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_chunks: int = 64):
+        self._loop = loop
+        self._chunks: queue.Queue = queue.Queue(maxsize=max_chunks)
+        self._consumed = asyncio.Event()
+        self._buffer = b""
+        self._eof = False
+        self.closed = False
+
+    async def put(self, chunk: bytes) -> bool:
+        while not self.closed:
+            try:
+                self._chunks.put_nowait(chunk)
+                break
+            except queue.Full:
+                # A signal sent after the failed put is scheduled after this clear, so none is lost
+                self._consumed.clear()
+                await self._consumed.wait()
+        return not self.closed
+
+    async def finish(self) -> None:
+        await self.put(b"")
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            chunk = self._chunks.get()
+            self._loop.call_soon_threadsafe(self._consumed.set)
+            self._eof = not chunk
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self) -> None:
+        self.closed = True
+        self._loop.call_soon_threadsafe(self._consumed.set)
+
+
+def _decode_in_process(source: Union[str, _ChunkReader]) -> bytearray:
+    # Decode the first audio track with PyAV and resample to 16 kHz mono float32, as the ffmpeg
+    # command line does. A URL is opened by libavformat itself, which can seek with range requests.
+    options = {"rw_timeout": str(int(DOWNLOAD_TIMEOUT * 1_000_000))} if isinstance(source, str) else {}
+    pcm = bytearray()
+    try:
+        with av.open(source, mode="r", options=options) as container:
+            if not container.streams.audio:
+                raise NoAudioTrack("The video has no audio track")
+            resampler = av.AudioResampler(format="flt", layout="mono", rate=SAMPLE_RATE)
+            for frame in container.decode(container.streams.audio[0]):
+                for resampled in resampler.resample(frame):
+                    pcm += resampled.to_ndarray().tobytes()
+            for resampled in resampler.resample(None):
+                pcm += resampled.to_ndarray().tobytes()
+    finally:
+        if isinstance(source, _ChunkReader):
+            source.close()
+    return pcm
+
+
+async def _decode_pyav(source: Union[str, AsyncIterator[bytes]]) -> tuple[bytearray, Optional[str]]:
+    """
+    PCM decoded by PyAV on the decoder pool from a path or URL or from chunks of the file, with
+    the error message if decoding failed.
+    """
+    loop = asyncio.get_running_loop()
+    reader = None if isinstance(source, str) else _ChunkReader(loop)
+    started = time.perf_counter()
+    decoding = loop.run_in_executor(_decoder_pool, _decode_in_process, reader or source)
+
+    fed = started
+    try:
+        if reader is not None:
+            try:
+                async for chunk in source:
+                    DOWNLOAD_BYTES.inc(len(chunk))
+                    if not await reader.put(chunk):
+                        break
+            finally:
+                await reader.finish()
+                fed = time.perf_counter()
+                STAGE_SECONDS.observe(fed - started, stage="download")
+
+        try:
+            pcm, errors = await decoding, None
+        except NoAudioTrack:
+            raise
+        except (av.error.FFmpegError, ValueError) as e:
+            pcm, errors = bytearray(), str(e)
+    finally:
+        # When the download fails the decoder reads to the end of what it got; its decode slot is
+        # only given back once it has stopped, and its error is retrieved
+        await asyncio.gather(decoding, return_exceptions=True)
+    # Decoding overlaps the download, only what is left after the last byte counts as decode time
+    STAGE_SECONDS.observe(time.perf_counter() - fed, stage="decode")
+    return pcm, errors
+
+
+def _to_tensor(pcm: bytearray) -> torch.Tensor:
+    if len(pcm) == 0:
+        raise ValueError("No audio decoded from the video")
+    return torch.frombuffer(pcm, dtype=torch.float32)
+
+
+async def fetch_validator(url: str) -> Optional[str]:
+    """
+    ETag or Last-Modified of the resource at url from a HEAD request, None if the host sends
+    neither or does not answer HEAD.
+    """
+    try:
+        with timed("validator"):
+            response = await http_client.head(url)
+        response.raise_for_status()
+    except httpx.HTTPError:
+        return None
+    return response.headers.get("etag") or response.headers.get("last-modified")
+
+
+def pcm_digest(audio: torch.Tensor) -> str:
+    return hashlib.sha256(audio.numpy()).hexdigest()
+
+
+async def load_audio(url: str) -> torch.Tensor:
+    """
+    Download the video at url and decode its audio track to 16 kHz mono float32 PCM.
+
+    The HTTP body is fed to the decoder chunk by chunk, so decoding starts before the download
+    finishes and neither the video nor the audio ever touches disk. MP4 files with the moov atom
+    at the end cannot be demuxed from a stream; for those the decoder is retried on the URL
+    itself, where it can issue range requests to seek. A video without an audio track raises
+    NoAudioTrack without a retry.
+
+    With AUDIO_DECODER pyav the decoder is PyAV on a pool of DECODE_CONCURRENCY threads, with
+    ffmpeg one ffmpeg process per video. At most DECODE_CONCURRENCY pipelines run at once, the
+    rest wait on the event loop.
+    """
+    waiting = time.perf_counter()
+    async with _decode_slots:
+        STAGE_SECONDS.observe(time.perf_counter() - waiting, stage="decode_wait")
+        if AUDIO_DECODER == "pyav":
+            async with http_client.stream("GET", url) as response:
+                response.raise_for_status()
+                pcm, errors = await _decode_pyav(response.aiter_bytes(CHUNK_SIZE))
+            if errors is not None or len(pcm) == 0:
+                pcm, errors = await _decode_pyav(url)
+                if errors is not None:
+                    raise RuntimeError(f"Decoding failed: {errors}")
+            return _to_tensor(pcm)
+
+        async with http_client.stream("GET", url) as response:
+            response.raise_for_status()
+            proc = await _ffmpeg("pipe:0")
+            pcm, returncode, errors = await _decode(proc, response.aiter_bytes(CHUNK_SIZE))
+
+        if NO_OUTPUT_STREAM in errors:
+            raise NoAudioTrack("The video has no audio track")
+        if returncode != 0 or len(pcm) == 0:
+            pcm, returncode, errors = await _decode(await _ffmpeg(url))
+            if returncode != 0:
+                raise RuntimeError(f"ffmpeg failed with exit code {returncode}: {errors}")
+
+    return _to_tensor(pcm)
+
+
+async def decode_file(path: str, decoder: str = AUDIO_DECODER) -> torch.Tensor:
+    """Audio track of a local file as 16 kHz mono float32 PCM, with either decoder."""
+    if decoder == "pyav":
+        pcm, errors = await _decode_pyav(path)
+        if errors is not None:
+            raise RuntimeError(f"Decoding failed: {errors}")
+        return _to_tensor(pcm)
+
+    pcm, returncode, errors = await _decode(await _ffmpeg(path))
+    if returncode != 0:
+        raise RuntimeError(f"ffmpeg failed with exit code {returncode}: {errors}")
+    return _to_tensor(pcm)
@@ -0,0 +1,277 @@
+"""
+Microbenchmarks for the transcription pipeline.
+
+Run inside the service directory with its parent on the path, e.g.
+    cd /workspace/data && PYTHONPATH=/workspace python -m data.bench batching --audio sample.wav
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from typing import Optional
+
+import torch
+import torchaudio
+
+from .audio import SAMPLE_RATE, decode_file
+from .config import (
+    DECODE_CONCURRENCY,
+    NO_SPEECH_MIN_MODULATION_DB,
+    NO_SPEECH_MIN_SECONDS,
+    ONNX_DIR,
+    SEGMENT_MAX_SECONDS,
+)
+from .inference import PROFILES, load_model, pad_batch, transcribe_batch
+from .vad import FRAME_SECONDS, FRAME_SIZE, GATE_BLOCK_FRAMES, has_speech, split_on_silence, syllable_modulation
+
+
+def load_clip(path: str, duration: Optional[float] = None) -> torch.Tensor:
+    waveform, sample_rate = torchaudio.load(path)
+    waveform = torchaudio.functional.resample(waveform.mean(dim=0), sample_rate, SAMPLE_RATE)
+    if duration is not None:
+        waveform = waveform[: int(duration * SAMPLE_RATE)]
+    return waveform.contiguous()
+
+
+def timed(fn, repeats: int) -> float:
+    fn()  # warmup
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def bench_batching(args) -> None:
+    model = load_model("cpu")
+    clip = load_clip(args.audio, args.duration)
+    clip_seconds = clip.shape[0] / SAMPLE_RATE
+
+    print(f"clip {clip_seconds:.1f}s, {torch.get_num_threads()} threads")
+    print(f"{'batch':>5} {'latency, s':>11} {'per item, s':>12} {'items/s':>8} {'audio s/s':>10}")
+    for batch_size in args.batch_sizes:
+        # Vary lengths a little so padding is exercised like with real traffic
+        signals = [clip[: clip.shape[0] - i * SAMPLE_RATE // 10] for i in range(batch_size)]
+        audio_seconds = sum(signal.shape[0] for signal in signals) / SAMPLE_RATE
+        latency = timed(lambda: transcribe_batch(model, signals), args.repeats)
+        print(
+            f"{batch_size:>5} {latency:>11.3f} {latency / batch_size:>12.3f} "
+            f"{batch_size / latency:>8.2f} {audio_seconds / latency:>10.1f}"
+        )
+
+
+def bench_direct(args) -> None:
+    model = load_model("cpu")
+    clip = load_clip(args.audio, args.duration)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        audio_path = os.path.join(tmp_dir, "clip.wav")
+        torchaudio.save(audio_path, clip.unsqueeze(0), SAMPLE_RATE)
+        nemo_text = model.transcribe([audio_path])[0][0]
+        nemo_latency = timed(lambda: model.transcribe([audio_path]), args.repeats)
+
+    direct_text = transcribe_batch(model, [clip])[0]
+    direct_latency = timed(lambda: transcribe_batch(model, [clip]), args.repeats)
+
+    print(f"clip {clip.shape[0] / SAMPLE_RATE:.1f}s, {torch.get_num_threads()} threads")
+    print(f"model.transcribe(): {nemo_latency * 1000:8.1f} ms")
+    print(f"transcribe_batch(): {direct_latency * 1000:8.1f} ms ({nemo_latency / direct_latency:.2f}x)")
+    print(f"same transcript: {nemo_text == direct_text}")
+
+
+def reference_features(featurizer, signal: torch.Tensor, lengths: torch.Tensor) -> torch.Tensor:
+    # NeMo's FilterbankFeaturesTA.forward with the torchaudio MelSpectrogram module
+    features = featurizer._mel_spec_extractor(signal)
+    features = featurizer._apply_log(features)
+    return featurizer._apply_normalization(features, featurizer._compute_output_lengths(lengths))
+
+
+def bench_frontend(args) -> None:
+    featurizer = load_model(args.device).preprocessor.featurizer
+    generator = torch.Generator().manual_seed(0)
+
+    print(f"{'batch':>5} {'reference, ms':>14} {'fused, ms':>10} {'max abs diff':>13}")
+    for batch_size in args.batch_sizes:
+        lengths = torch.randint(SAMPLE_RATE, int(args.duration * SAMPLE_RATE), (batch_size,), generator=generator)
+        signals = [0.1 * torch.randn(int(length), generator=generator) for length in lengths]
+        signal, lengths = pad_batch(signals)
+        signal, lengths = signal.to(args.device), lengths.to(args.device)
+
+        with torch.inference_mode():
+            expected = reference_features(featurizer, signal, lengths)
+            actual, _ = featurizer(signal, lengths)
+            reference_latency = timed(lambda: reference_features(featurizer, signal, lengths), args.repeats)
+            fused_latency = timed(lambda: featurizer(signal, lengths), args.repeats)
+
+        diff = (actual - expected).abs().max().item()
+        print(f"{batch_size:>5} {reference_latency * 1000:>14.2f} {fused_latency * 1000:>10.2f} {diff:>13.2e}")
+        assert torch.allclose(actual, expected, atol=args.atol), f"batch {batch_size}: features differ by {diff}"
+
+
+def word_errors(reference: str, hypothesis: str) -> tuple[int, int]:
+    # Word-level edit distance and reference length
+    ref, hyp = reference.split(), hypothesis.split()
+    row = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        prev, row[0] = row[0], i
+        for j, hyp_word in enumerate(hyp, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (ref_word != hyp_word))
+    return row[-1], len(ref)
+
+
+def wer(references: list[str], hypotheses: list[str]) -> float:
+    errors, words = map(sum, zip(*(word_errors(r, h) for r, h in zip(references, hypotheses))))
+    return errors / max(words, 1)
+
+
+def load_references(path: str) -> dict[str, str]:
+    # One "<file name>\t<transcript>" per line
+    with open(path, encoding="utf-8") as f:
+        return dict(line.rstrip("\n").split("\t", 1) for line in f if "\t" in line)
+
+
+def load_transcriber(profile: str):
+    if profile == "onnx":
+        from .onnx_backend import OnnxTranscriber
+
+        return OnnxTranscriber(ONNX_DIR, torch.get_num_threads()).transcribe_batch
+    model = load_model("cpu", profile)
+    return lambda signals: transcribe_batch(model, signals)
+
+
+def bench_profiles(args) -> None:
+    names = sorted(name for name in os.listdir(args.audio_dir) if not name.startswith("."))
+    clips = [load_clip(os.path.join(args.audio_dir, name)) for name in names]
+    audio_seconds = sum(clip.shape[0] for clip in clips) / SAMPLE_RATE
+    references = load_references(args.references) if args.references else None
+
+    print(f"{len(clips)} files, {audio_seconds:.0f}s of audio, {torch.get_num_threads()} threads")
+    print(f"{'profile':>8} {'RTF':>7} {'WER vs ' + args.profiles[0]:>12} {'WER vs refs':>12}")
+    baseline = None
+    for profile in args.profiles:
+        run_transcription = load_transcriber(profile)
+        run_transcription([clips[0][:SAMPLE_RATE]])  # warmup
+
+        start = time.perf_counter()
+        texts = [
+            " ".join(t for t in run_transcription(split_on_silence(clip, SEGMENT_MAX_SECONDS)) if t)
+            for clip in clips
+        ]
+        rtf = (time.perf_counter() - start) / audio_seconds
+
+        baseline = baseline or texts
+        drift = wer(baseline, texts)
+        accuracy = f"{wer([references.get(n, '') for n in names], texts):>12.2%}" if references else f"{'-':>12}"
+        print(f"{profile:>8} {rtf:>7.3f} {drift:>12.2%} {accuracy}")
+        del run_transcription
+
+
+async def decode_all(paths: list[str], decoder: str, concurrency: int) -> list[torch.Tensor]:
+    slots = asyncio.Semaphore(concurrency)
+
+    async def decode(path: str) -> torch.Tensor:
+        async with slots:
+            return await decode_file(path, decoder)
+
+    return await asyncio.gather(*(decode(path) for path in paths))
+
+
+def bench_decode(args) -> None:
+    paths = args.videos * args.repeats
+    print(f"{len(args.videos)} files x {args.repeats}, concurrency {args.concurrency}")
+    print(f"{'decoder':>8} {'wall, s':>8} {'per file, ms':>13} {'audio s/s':>10} {'samples vs ffmpeg':>18} {'max abs diff':>13}")
+    reference = None
+    for decoder in args.decoders:
+        asyncio.run(decode_all(args.videos[:1], decoder, 1))  # warmup
+        start = time.perf_counter()
+        decoded = asyncio.run(decode_all(paths, decoder, args.concurrency))
+        wall = time.perf_counter() - start
+        audio_seconds = sum(pcm.shape[0] for pcm in decoded) / SAMPLE_RATE
+
+        if decoder == "ffmpeg":
+            reference = decoded
+        if reference is not None:
+            lengths = sum(pcm.shape[0] - ref.shape[0] for pcm, ref in zip(decoded, reference))
+            diff = max(
+                (pcm[: ref.shape[0]] - ref[: pcm.shape[0]]).abs().max().item() for pcm, ref in zip(decoded, reference)
+            )
+            comparison = f"{lengths:>+18d} {diff:>13.2e}"
+        else:
+            comparison = f"{'-':>18} {'-':>13}"
+        print(f"{decoder:>8} {wall:>8.2f} {wall / len(paths) * 1000:>13.1f} {audio_seconds / wall:>10.0f} {comparison}")
+
+
+def bench_vad(args) -> None:
+    # Run on speech, music-only and silent clips to check GIGAAM_NO_SPEECH_MIN_MODULATION_DB
+    print(f"min voiced {NO_SPEECH_MIN_SECONDS}s, min modulation {args.min_modulation_db} dB")
+    print(f"{'file':<40} {'duration, s':>11} {'modulation, dB':>27} {'no modulation check':>20} {'gate':>7}")
+    for path in args.audio:
+        clip = load_clip(path)
+        num_frames = clip.shape[0] // FRAME_SIZE
+        energy_db = 10 * torch.log10(clip[: num_frames * FRAME_SIZE].view(num_frames, FRAME_SIZE).pow(2).mean(dim=1) + 1e-10)
+        # Per 10 s block, as the gate sees them
+        modulation = [
+            syllable_modulation(energy_db[start : start + GATE_BLOCK_FRAMES]) for start in range(0, num_frames, GATE_BLOCK_FRAMES)
+        ]
+        summary = f"{min(modulation):.1f} / {sorted(modulation)[len(modulation) // 2]:.1f} / {max(modulation):.1f}" if modulation else "-"
+        voiced = has_speech(clip, NO_SPEECH_MIN_SECONDS, 0)
+        speech = has_speech(clip, NO_SPEECH_MIN_SECONDS, args.min_modulation_db)
+        print(
+            f"{path[-40:]:<40} {num_frames * FRAME_SECONDS:>11.1f} {summary + ' (min/median/max)':>27} "
+            f"{'speech' if voiced else 'none':>20} {'speech' if speech else 'none':>7}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    batching = subparsers.add_parser("batching", help="RNNT throughput/latency per batch size")
+    batching.add_argument("--audio", required=True, help="any audio or video file")
+    batching.add_argument("--duration", type=float, default=10.0, help="seconds of the clip to use")
+    batching.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    batching.add_argument("--repeats", type=int, default=5)
+    batching.set_defaults(func=bench_batching)
+
+    direct = subparsers.add_parser("direct", help="direct tensor path against model.transcribe()")
+    direct.add_argument("--audio", required=True, help="any audio or video file")
+    direct.add_argument("--duration", type=float, default=5.0, help="seconds of the clip to use")
+    direct.add_argument("--repeats", type=int, default=10)
+    direct.set_defaults(func=bench_direct)
+
+    frontend = subparsers.add_parser("frontend", help="mel front-end against the torchaudio path, with an equivalence check")
+    frontend.add_argument("--device", default="cpu")
+    frontend.add_argument("--duration", type=float, default=20.0, help="longest random waveform, seconds")
+    frontend.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    frontend.add_argument("--repeats", type=int, default=10)
+    frontend.add_argument("--atol", type=float, default=1e-4, help="tolerance on log-mel features")
+    frontend.set_defaults(func=bench_frontend)
+
+    profiles = subparsers.add_parser("profiles", help="real-time factor and WER drift of model profiles on CPU")
+    profiles.add_argument("--audio-dir", required=True, help="directory of audio or video files")
+    profiles.add_argument("--references", help="optional TSV of file name and reference transcript")
+    profiles.add_argument("--profiles", nargs="+", choices=PROFILES + ("onnx",), default=list(PROFILES))
+    profiles.set_defaults(func=bench_profiles)
+
+    decode = subparsers.add_parser("decode", help="audio decode time of the ffmpeg process and the in-process PyAV decoder")
+    decode.add_argument("--videos", nargs="+", required=True, help="local video files")
+    decode.add_argument("--decoders", nargs="+", choices=["ffmpeg", "pyav"], default=["ffmpeg", "pyav"])
+    decode.add_argument("--concurrency", type=int, default=DECODE_CONCURRENCY)
+    decode.add_argument("--repeats", type=int, default=3)
+    decode.set_defaults(func=bench_decode)
+
+    vad = subparsers.add_parser("vad", help="no-speech gate decisions and syllable-rate modulation per clip")
+    vad.add_argument("--audio", nargs="+", required=True, help="audio or video files: speech, music-only, silence")
+    vad.add_argument("--min-modulation-db", type=float, default=NO_SPEECH_MIN_MODULATION_DB)
+    vad.set_defaults(func=bench_vad)
+
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
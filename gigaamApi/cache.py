@@ -0,0 +1,164 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional
+
+LOCK = ".lock"
+# Bytes and number of entries of the whole directory, as "<bytes> <entries>"
+USAGE = "usage"
+
+
+class TranscriptCache:
+    """
+    Transcripts and keyword lists keyed by content, kept on disk with an in-memory LRU in front.
+
+    Entries are small JSON documents stored one per file under directory, named by the SHA-256 of
+    their key. Reads refresh a file's mtime, and when the directory grows past max_bytes the files
+    with the oldest mtime are removed first, so disk eviction is LRU as well. Eviction frees down to
+    90% of max_bytes so the directory is not rescanned on every write once full.
+
+    The directory may be shared by several server processes. The total size is kept in a usage
+    file that writes update under an flock, and eviction rescans the directory under the same
+    lock, so max_bytes holds for all processes together. Hit and miss counts are per process.
+
+    Methods do blocking file I/O; call them from a thread, not from the event loop.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, memory_items: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.hits = 0
+        self.misses = 0
+        self._memory: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._lock_path = os.path.join(directory, LOCK)
+        self._usage_path = os.path.join(directory, USAGE)
+
+        os.makedirs(directory, exist_ok=True)
+        with self._locked():
+            self._write_usage(*self._scan_usage())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest() + ".json")
+
+    @contextmanager
+    def _locked(self):
+        with open(self._lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _entries(self) -> list[tuple[str, os.stat_result]]:
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".json"):
+                try:
+                    files.append((entry.path, entry.stat()))
+                except OSError:
+                    pass
+        return files
+
+    def _scan_usage(self) -> tuple[int, int]:
+        files = self._entries()
+        return sum(stat.st_size for _, stat in files), len(files)
+
+    def _read_usage(self) -> tuple[int, int]:
+        try:
+            with open(self._usage_path) as f:
+                total_bytes, entries = f.read().split()
+            return int(total_bytes), int(entries)
+        except (OSError, ValueError):
+            return self._scan_usage()
+
+    def _write_usage(self, total_bytes: int, entries: int) -> None:
+        tmp_path = f"{self._usage_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(f"{total_bytes} {entries}")
+        os.replace(tmp_path, self._usage_path)
+
+    def _remember(self, key: str, entry: dict) -> None:
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str, count_miss: bool = True) -> Optional[dict]:
+        """The entry under key. count_miss=False when another key of the same lookup is tried next."""
+        with self._lock:
+            entry = self._memory.get(key)
+            path = self._path(key)
+            if entry is None:
+                try:
+                    with open(path, encoding="utf-8") as f:
+                        entry = json.load(f)
+                except (OSError, ValueError):
+                    if count_miss:
+                        self.misses += 1
+                    return None
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            self._remember(key, entry)
+            self.hits += 1
+            return dict(entry)
+
+    def count_miss(self) -> None:
+        """Count a lookup that ended without trying another key with get."""
+        with self._lock:
+            self.misses += 1
+
+    def put(self, key: str, entry: dict) -> None:
+        data = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+        with self._lock:
+            self._remember(key, dict(entry))
+            path = self._path(key)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            with self._locked():
+                try:
+                    replaced = os.stat(path).st_size
+                except OSError:
+                    replaced = None
+                os.replace(tmp_path, path)
+                total_bytes, entries = self._read_usage()
+                total_bytes += len(data) - (replaced or 0)
+                entries += replaced is None
+                if total_bytes > self.max_bytes:
+                    total_bytes, entries = self._evict()
+                self._write_usage(total_bytes, entries)
+
+    def _evict(self) -> tuple[int, int]:
+        # Sizes and mtimes are rescanned, other processes write and read the same files
+        files = sorted(self._entries(), key=lambda file: file[1].st_mtime)
+        total_bytes = sum(stat.st_size for _, stat in files)
+        entries = len(files)
+        for path, stat in files:
+            if total_bytes <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_bytes -= stat.st_size
+            entries -= 1
+        return total_bytes, entries
+
+    def stats(self) -> dict:
+        total_bytes, entries = self._read_usage()
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": entries,
+                "bytes": total_bytes,
+            }
@@ -0,0 +1,69 @@
+import os
+
+# Number of download + ffmpeg decode pipelines allowed to run at once
+DECODE_CONCURRENCY = int(os.environ.get("GIGAAM_DECODE_CONCURRENCY", os.cpu_count() or 1))
+
+# pyav decodes audio in-process on a pool of DECODE_CONCURRENCY threads, ffmpeg runs an ffmpeg
+# process per video
+AUDIO_DECODER = os.environ.get("GIGAAM_AUDIO_DECODER", "pyav")
+
+# Seconds to wait for the video host to connect or send the next chunk
+DOWNLOAD_TIMEOUT = float(os.environ.get("GIGAAM_DOWNLOAD_TIMEOUT", 30))
+
+# Concurrent transcription requests are coalesced into one padded batch of up to this many
+# waveforms, waiting at most this long after the first one arrives
+MAX_BATCH_SIZE = int(os.environ.get("GIGAAM_MAX_BATCH_SIZE", 8))
+MAX_BATCH_WAIT = float(os.environ.get("GIGAAM_MAX_BATCH_WAIT_MS", 20)) / 1000
+
+# Audio is cut at pauses into segments of at most this many seconds, which are transcribed as
+# independent batch items, so attention cost and memory stay flat however long the video is
+SEGMENT_MAX_SECONDS = float(os.environ.get("GIGAAM_SEGMENT_MAX_SECONDS", 20))
+if SEGMENT_MAX_SECONDS < 1:
+    raise ValueError("GIGAAM_SEGMENT_MAX_SECONDS must be at least 1")
+
+# Transcripts and keywords are cached on disk under this directory, up to this many megabytes,
+# with the most recently used entries also kept in memory
+CACHE_DIR = os.environ.get("GIGAAM_CACHE_DIR", "./cache")
+CACHE_MAX_MB = float(os.environ.get("GIGAAM_CACHE_MAX_MB", 512))
+CACHE_MEMORY_ITEMS = int(os.environ.get("GIGAAM_CACHE_MEMORY_ITEMS", 1024))
+
+# Transcripts of concurrent /transcribe-keywords requests are passed to KeyBERT together, up to
+# this many; texts (documents and candidate words) are embedded this many per forward pass
+KEYWORDS_MAX_BATCH_SIZE = int(os.environ.get("GIGAAM_KEYWORDS_MAX_BATCH_SIZE", 16))
+EMBED_BATCH_SIZE = int(os.environ.get("GIGAAM_EMBED_BATCH_SIZE", 64))
+
+# /embed accepts up to this many texts per request and keeps the embeddings of this many recently
+# requested texts in memory
+EMBED_MAX_TEXTS = int(os.environ.get("GIGAAM_EMBED_MAX_TEXTS", 1024))
+EMBED_CACHE_ITEMS = int(os.environ.get("GIGAAM_EMBED_CACHE_ITEMS", 65536))
+
+# Embeddings of candidate words are persisted here and reused across requests and restarts
+EMBEDDING_STORE_DIR = os.environ.get("GIGAAM_EMBEDDING_STORE_DIR", "./embeddings")
+
+# Audio with less than this many seconds of loud, voiced frames is answered as no speech without
+# running the transcriber; 0 disables the check
+NO_SPEECH_MIN_SECONDS = float(os.environ.get("GIGAAM_NO_SPEECH_MIN_SECONDS", 0.5))
+# Voiced frames only count where the loudness varies at syllable rate by at least this many dB,
+# which keeps music without vocals out of the transcriber; 0 disables the check
+NO_SPEECH_MIN_MODULATION_DB = float(os.environ.get("GIGAAM_NO_SPEECH_MIN_MODULATION_DB", 3.0))
+
+# Default number of audio seconds /transcribe-keywords transcribes, sampled as windows from the
+# start, middle and end of longer videos; 0 transcribes everything
+KEYWORDS_BUDGET_SECONDS = float(os.environ.get("GIGAAM_KEYWORDS_BUDGET_SECONDS", 0))
+
+# fp32, int8 for a dynamically quantized encoder on CPU, or onnx for onnxruntime on CPU with the
+# model exported to ONNX_DIR by export_onnx.py
+MODEL_PROFILE = os.environ.get("GIGAAM_MODEL_PROFILE", "fp32")
+ONNX_DIR = os.environ.get("GIGAAM_ONNX_DIR", "./onnx")
+ONNX_THREADS = int(os.environ.get("GIGAAM_ONNX_THREADS", os.cpu_count() or 1))
+
+# Pre-fork serving with gunicorn.conf.py: worker processes sharing the models loaded once by the
+# parent, intra-op threads of each worker (defaults to an equal share of the CPUs), and whether
+# each worker is pinned to its own set of that many cores
+WORKERS = int(os.environ.get("GIGAAM_WORKERS", 1))
+WORKER_THREADS = int(os.environ.get("GIGAAM_WORKER_THREADS", max(1, (os.cpu_count() or 1) // WORKERS)))
+PIN_CPUS = os.environ.get("GIGAAM_PIN_CPUS", "0") == "1"
+
+# eager loads the keyword model at startup alongside the RNNT model and /ready waits for it, lazy
+# loads it on the first /transcribe-keywords request, off disables keyword extraction
+KEYWORDS_MODEL = os.environ.get("GIGAAM_KEYWORDS_MODEL", "eager")
@@ -0,0 +1,106 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable
+
+from .metrics import BATCH_SIZE, INFERENCE_SECONDS, STAGE_SECONDS
+
+
+class BatchingWorker:
+    """
+    Coalesces concurrently submitted items into batches for a single dedicated thread.
+
+    Models are not safe to call from several threads at once and a blocking forward pass must not
+    run on the event loop, so every call into a model goes through the worker that owns it;
+    callers await the result without blocking the loop.
+
+    After the first item arrives the worker keeps collecting until max_batch_size items are
+    queued or max_wait seconds have passed, runs run_batch once over all of them and hands each
+    caller its own result. If a batch fails, its items are retried one by one so a single bad
+    input only fails its own request.
+
+    Threads do not survive fork, and a pre-forking server creates the workers in its parent process
+    along with the models, so the thread is started on the first submit in each process.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        run_batch: Callable[[list[Any]], list[Any]],
+        max_batch_size: int,
+        max_wait: float,
+    ):
+        self.name = name
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def _put(self, job: tuple) -> None:
+        # Only called from the event loop thread
+        if self._pid != os.getpid():
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+        self._queue.put(job)
+
+    def submit(self, item: Any) -> asyncio.Future:
+        future = Future()
+        self._put((future, item, time.perf_counter()))
+        return asyncio.wrap_future(future)
+
+    def _collect(self) -> list[tuple[Future, Any]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        started = time.perf_counter()
+        jobs = []
+        for future, item, submitted in batch:
+            if future.set_running_or_notify_cancel():
+                STAGE_SECONDS.observe(started - submitted, stage=f"{self.name}_queue")
+                jobs.append((future, item))
+        return jobs
+
+    def _run_and_resolve(self, batch: list[tuple[Future, Any]]) -> None:
+        started = time.perf_counter()
+        results = self.run_batch([item for _, item in batch])
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=self.name)
+        INFERENCE_SECONDS.inc(elapsed, worker=self.name)
+        BATCH_SIZE.observe(len(batch), worker=self.name)
+        for (future, _), result in zip(batch, results):
+            future.set_result(result)
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            if not batch:
+                continue
+            try:
+                self._run_and_resolve(batch)
+            except BaseException as e:
+                if len(batch) == 1:
+                    batch[0][0].set_exception(e)
+                    continue
+                for job in batch:
+                    try:
+                        self._run_and_resolve([job])
+                    except BaseException as e:
+                        job[0].set_exception(e)
@@ -0,0 +1,119 @@
+"""
+Export the RNNT model for the onnx model profile.
+
+Writes the Conformer encoder, the prediction network and the joint network as ONNX with dynamic
+batch and time axes, plus the mel front-end parameters and the tokenizer. Run inside the service
+directory with its parent on the path:
+    cd /workspace/data && PYTHONPATH=/workspace python -m data.export_onnx
+"""
+import argparse
+import os
+import shutil
+
+import numpy as np
+import torch
+from nemo.core.classes.common import typecheck
+
+from .config import ONNX_DIR
+from .inference import load_model
+from .onnx_backend import DECODER, ENCODER, JOINT, PARAMS, TOKENIZER
+
+
+class PredictionNetwork(torch.nn.Module):
+    # One step of the LSTM prediction network: previous token and state in, output and state out
+    def __init__(self, decoder):
+        super().__init__()
+        self.decoder = decoder
+
+    def forward(self, tokens: torch.Tensor, h: torch.Tensor, c: torch.Tensor):
+        prediction, (h, c) = self.decoder.predict(tokens, state=[h, c], add_sos=False)
+        return prediction[:, 0, :], h, c
+
+
+class JointNetwork(torch.nn.Module):
+    # Logits for one encoder frame and one prediction network output
+    def __init__(self, joint):
+        super().__init__()
+        self.joint = joint
+
+    def forward(self, encoder_frame: torch.Tensor, prediction: torch.Tensor):
+        return self.joint.joint(encoder_frame[:, None, :], prediction[:, None, :])[:, 0, 0, :]
+
+
+def export(directory: str, opset: int) -> None:
+    model = load_model("cpu")
+    featurizer = model.preprocessor.featurizer
+    if featurizer._preemphasis_value is not None or featurizer._normalize_strategy is not None:
+        raise ValueError("The onnx front-end only implements log mel without pre-emphasis or normalization")
+    if featurizer._log_zero_guard_type not in ("add", "clamp"):
+        raise ValueError(f"Unsupported log_zero_guard_type {featurizer._log_zero_guard_type!r}")
+    if not isinstance(featurizer._pad_to, int) or featurizer._pad_to < 0:
+        raise ValueError(f"The onnx front-end only pads to a multiple of frames, not pad_to={featurizer._pad_to!r}")
+    os.makedirs(directory, exist_ok=True)
+
+    # NeMo's own export prepares the Conformer for tracing and marks the time axes dynamic
+    model.encoder.export(os.path.join(directory, ENCODER), onnx_opset_version=opset)
+
+    state = model.decoder.initialize_state(torch.zeros(1, 1))
+    tokens = torch.zeros(1, 1, dtype=torch.long)
+    with torch.no_grad(), typecheck.disable_checks():
+        torch.onnx.export(
+            PredictionNetwork(model.decoder),
+            (tokens, *state),
+            os.path.join(directory, DECODER),
+            input_names=["tokens", "h", "c"],
+            output_names=["prediction", "h_out", "c_out"],
+            dynamic_axes={
+                "tokens": {0: "B"},
+                "h": {1: "B"},
+                "c": {1: "B"},
+                "prediction": {0: "B"},
+                "h_out": {1: "B"},
+                "c_out": {1: "B"},
+            },
+            opset_version=opset,
+        )
+        prediction = PredictionNetwork(model.decoder)(tokens, *state)[0]
+        torch.onnx.export(
+            JointNetwork(model.joint),
+            (torch.zeros(1, model.cfg.model_defaults.enc_hidden), prediction),
+            os.path.join(directory, JOINT),
+            input_names=["encoder_frame", "prediction"],
+            output_names=["logits"],
+            dynamic_axes={"encoder_frame": {0: "B"}, "prediction": {0: "B"}, "logits": {0: "B"}},
+            opset_version=opset,
+        )
+
+    # Every setting of the front-end that onnx_backend.featurize computes with, so that a config
+    # change reaches both profiles
+    spectrogram = featurizer._mel_spec_extractor.spectrogram
+    np.savez(
+        os.path.join(directory, PARAMS),
+        window=featurizer.stft_window.numpy(),
+        mel_fb=featurizer.mel_fb.numpy(),
+        stft=np.array([spectrogram.n_fft, spectrogram.hop_length, spectrogram.win_length]),
+        center=np.array(spectrogram.center),
+        pad_mode=np.array(spectrogram.pad_mode),
+        mag_power=np.array(spectrogram.power),
+        log=np.array(featurizer._use_log),
+        log_zero_guard_type=np.array(featurizer._log_zero_guard_type),
+        log_zero_guard=np.array(featurizer._resolve_log_zero_guard_value(torch.float32)),
+        pad_to=np.array(featurizer._pad_to),
+        pad_value=np.array(featurizer._pad_value),
+        blank=np.array(model.decoder.blank_idx),
+        max_symbols=np.array(model.cfg.decoding.greedy.max_symbols),
+        state_shape=np.array([state[0].shape[0], state[0].shape[2]]),
+    )
+    shutil.copy(os.path.join(model.cfg.tokenizer.dir, "tokenizer.model"), os.path.join(directory, TOKENIZER))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default=ONNX_DIR)
+    parser.add_argument("--opset", type=int, default=17)
+    args = parser.parse_args()
+    export(args.output, args.opset)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# Pre-fork CPU serving: `gunicorn -c gunicorn.conf.py` from this directory.
+#
+# The app is imported and both models are loaded once in the master process (preload_app) and the
+# workers are forked from it, so the weights are shared copy-on-write instead of being loaded once
+# per worker: inference only reads them. Each worker then runs its own event loop, inference
+# threads and PyTorch intra-op pool of WORKER_THREADS threads.
+import gc
+import importlib
+import os
+import sys
+
+directory = os.path.dirname(os.path.abspath(__file__))
+package = os.path.basename(directory)
+sys.path.insert(0, os.path.dirname(directory))
+config = importlib.import_module(f"{package}.config")
+
+if config.MODEL_PROFILE == "onnx" and config.WORKERS > 1:
+    # onnxruntime starts its thread pools when a session is created, and they do not survive fork
+    raise RuntimeError("Pre-fork serving supports the fp32 and int8 model profiles, not onnx")
+
+# CUDA cannot be used after fork, the workers run on CPU
+os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+wsgi_app = f"{package}.main:app"
+bind = "0.0.0.0:80"
+workers = config.WORKERS
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+forwarded_allow_ips = "*"
+
+
+def when_ready(server):
+    # Models load in background threads, which are not forked: workers start once they are loaded.
+    # Warmup runs in each worker.
+    importlib.import_module(wsgi_app.split(":")[0]).wait_loaded()
+    # Objects created while loading are never collected; keeps the collector from writing to
+    # their pages in every worker and unsharing them
+    gc.freeze()
+
+
+def pre_fork(server, worker):
+    # Runs in the master: the lowest CPU slot not used by a live worker, so a restarted worker
+    # takes over the cores of the one it replaces
+    used = {getattr(w, "cpu_slot", None) for w in server.WORKERS.values()}
+    worker.cpu_slot = min(set(range(config.WORKERS)) - used)
+
+
+def post_fork(server, worker):
+    import torch
+
+    torch.set_num_threads(config.WORKER_THREADS)
+    if config.PIN_CPUS:
+        cpus = sorted(os.sched_getaffinity(0))
+        start = worker.cpu_slot * config.WORKER_THREADS
+        os.sched_setaffinity(0, cpus[start : start + config.WORKER_THREADS] or cpus)
@@ -0,0 +1,101 @@
+import os
+
+import torch
+from nemo.collections.asr.models import EncDecRNNTBPEModel
+from nemo.core.classes.common import typecheck
+
+MODEL_CONFIG = "./rnnt_model_config.yaml"
+MODEL_WEIGHTS = "./rnnt_model_weights.ckpt"
+INT8_WEIGHTS = "./rnnt_model_weights.int8.pt"
+
+PROFILES = ("fp32", "int8")
+
+
+def quantize_encoder(model: EncDecRNNTBPEModel) -> None:
+    # Every Linear of the Conformer: subsampling output, feed-forward modules and the attention
+    # q/k/v/out/pos projections. Convolutions and the small RNNT decoder stay fp32.
+    torch.ao.quantization.quantize_dynamic(model.encoder, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def _load_checkpoint(path: str) -> dict:
+    # Memory-mapped: tensors are paged in from the file as they are used instead of the whole
+    # checkpoint being read into memory first
+    return torch.load(path, map_location="cpu", mmap=True, weights_only=False)
+
+
+def _weights_version() -> list[int]:
+    stat = os.stat(MODEL_WEIGHTS)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _load_int8(model: EncDecRNNTBPEModel) -> None:
+    # The quantized state dict is cached next to the fp32 checkpoint and rebuilt when it changes
+    version = _weights_version()
+    if os.path.exists(INT8_WEIGHTS):
+        cached = _load_checkpoint(INT8_WEIGHTS)
+        if cached["version"] == version:
+            quantize_encoder(model)
+            model.load_state_dict(cached["state_dict"], strict=False)
+            return
+
+    model.load_state_dict(_load_checkpoint(MODEL_WEIGHTS), strict=False)
+    quantize_encoder(model)
+    torch.save({"version": version, "state_dict": model.state_dict()}, INT8_WEIGHTS + ".tmp")
+    os.replace(INT8_WEIGHTS + ".tmp", INT8_WEIGHTS)
+
+
+def load_model(device: str, profile: str = "fp32") -> EncDecRNNTBPEModel:
+    """
+    Build the RNNT model and load its weights for one of PROFILES.
+
+    int8 applies dynamic quantization to the encoder and runs on CPU only. fp32 parameters are
+    assigned the memory-mapped checkpoint tensors, so on CPU they stay backed by the file's pages
+    and are not copied.
+    """
+    model = EncDecRNNTBPEModel.from_config_file(MODEL_CONFIG)
+    if profile == "fp32":
+        model.load_state_dict(_load_checkpoint(MODEL_WEIGHTS), strict=False, assign=True)
+    elif profile == "int8":
+        if device != "cpu":
+            raise ValueError("The int8 model profile runs on CPU only")
+        _load_int8(model)
+    else:
+        raise ValueError(f"Unknown model profile {profile}, expected one of {PROFILES}")
+    model.eval()
+    return model.to(device)
+
+
+def pad_batch(signals: list[torch.Tensor]) -> tuple[torch.Tensor, torch.Tensor]:
+    lengths = torch.tensor([signal.shape[0] for signal in signals], dtype=torch.long)
+    return torch.nn.utils.rnn.pad_sequence(signals, batch_first=True), lengths
+
+
+def transcribe_tensor(
+    model: EncDecRNNTBPEModel, signal: torch.Tensor, lengths: torch.Tensor
+) -> list[str]:
+    """
+    Transcribe a zero-padded batch of 16 kHz mono waveforms [B, T] with their lengths [B].
+
+    This is what model.transcribe() does after it has written a manifest, built a DataLoader and
+    read the audio back from disk: the mel preprocessor, the Conformer encoder and greedy RNNT
+    decoding. They are called directly here, without NeMo's per-call neural type checks and
+    without autograd bookkeeping. The preprocessor and the encoder mask everything past each
+    length and decoding stops at each encoded length, so padding does not leak into the
+    shorter transcripts.
+    """
+    device = next(model.parameters()).device
+    with torch.inference_mode(), typecheck.disable_checks():
+        features, features_len = model.preprocessor(
+            input_signal=signal.to(device), length=lengths.to(device)
+        )
+        encoded, encoded_len = model.encoder(audio_signal=features, length=features_len)
+        best_hyp, _ = model.decoding.rnnt_decoder_predictions_tensor(
+            encoder_output=encoded, encoded_lengths=encoded_len
+        )
+    return best_hyp
+
+
+def transcribe_batch(model: EncDecRNNTBPEModel, signals: list[torch.Tensor]) -> list[str]:
+    """Transcribe a list of 16 kHz mono waveforms of any lengths in one forward pass."""
+    signal, lengths = pad_batch(signals)
+    return transcribe_tensor(model, signal, lengths)
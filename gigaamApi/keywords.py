@@ -0,0 +1,242 @@
+import fcntl
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable
+
+import numpy as np
+from flair.data import Sentence
+from flair.embeddings import TransformerDocumentEmbeddings
+from sklearn.feature_extraction.text import CountVectorizer
+
+# Keywords returned per transcript, KeyBERT's default which the service has always used
+TOP_N = 5
+
+
+class BatchedFlairEmbedder:
+    """
+    Embeds texts through flair in padded batches.
+
+    KeyBERT's flair backend runs one forward pass per text, which for keyword extraction means
+    one per candidate word. Here texts are sorted by length, so that each batch pads to similar
+    lengths, and embedded batch_size at a time.
+    """
+
+    def __init__(self, embedding_model: TransformerDocumentEmbeddings, batch_size: int):
+        self.embedding_model = embedding_model
+        self.batch_size = batch_size
+
+    def _embed_one(self, document: str) -> np.ndarray:
+        # Same fallback as KeyBERT's flair backend for texts the transformer rejects
+        try:
+            sentence = Sentence(document) if document else Sentence("an empty document")
+            self.embedding_model.embed(sentence)
+        except RuntimeError:
+            sentence = Sentence("an empty document")
+            self.embedding_model.embed(sentence)
+        return sentence.embedding.detach().cpu().numpy()
+
+    def embed(self, documents: list[str]) -> np.ndarray:
+        order = sorted(range(len(documents)), key=lambda i: len(documents[i]))
+        embeddings: list[np.ndarray] = [None] * len(documents)
+        for start in range(0, len(order), self.batch_size):
+            indices = order[start : start + self.batch_size]
+            try:
+                sentences = [Sentence(documents[i] or "an empty document") for i in indices]
+                self.embedding_model.embed(sentences)
+                for i, sentence in zip(indices, sentences):
+                    embeddings[i] = sentence.embedding.detach().cpu().numpy()
+            except RuntimeError:
+                for i in indices:
+                    embeddings[i] = self._embed_one(documents[i])
+        return np.asarray(embeddings)
+
+
+class CachedEmbedder:
+    """
+    float16 embeddings of words and phrases, with the most recently requested max_items kept in an
+    LRU. The texts of several requests that miss the cache are embedded together.
+    """
+
+    def __init__(self, embedder: BatchedFlairEmbedder, max_items: int):
+        self.embedder = embedder
+        self.max_items = max_items
+        self._cache: OrderedDict[str, np.ndarray] = OrderedDict()
+
+    def embed_batch(self, requests: list[list[str]]) -> list[np.ndarray]:
+        """[len(texts), dim] float16 embeddings of the texts of each request."""
+        vectors = {}
+        for text in dict.fromkeys(text for texts in requests for text in texts):
+            if text in self._cache:
+                self._cache.move_to_end(text)
+                vectors[text] = self._cache[text]
+            else:
+                vectors[text] = None
+
+        missing = [text for text, vector in vectors.items() if vector is None]
+        if missing:
+            for text, vector in zip(missing, self.embedder.embed(missing).astype(np.float16)):
+                vectors[text] = self._cache[text] = vector
+            while len(self._cache) > self.max_items:
+                self._cache.popitem(last=False)
+        return [np.stack([vectors[text] for text in texts]) for texts in requests]
+
+
+class WordEmbeddingStore:
+    """
+    Word embeddings persisted across restarts and filled lazily.
+
+    Vectors live in a memory-mapped float16 .npy matrix under directory, one row per word, and
+    words.txt lists the words in row order. New rows are written and flushed before their words
+    are appended, so after a crash every listed word has its vector. The matrix doubles its
+    capacity when full. Not thread-safe: it is only used from the keyword worker thread.
+
+    Several server processes may share the directory: writes hold an exclusive lock on it, and
+    before writing a process picks up the words other processes have appended and remaps the
+    matrix if another process has grown it.
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self._vectors_path = os.path.join(directory, "vectors.npy")
+        self._words_path = os.path.join(directory, "words.txt")
+        self._lock_path = os.path.join(directory, ".lock")
+        self._vectors = None
+        self._vectors_inode = None
+        self._words_offset = 0
+        self.rows: dict[str, int] = {}
+
+        with self._locked():
+            words = []
+            if os.path.exists(self._vectors_path) and os.path.exists(self._words_path):
+                self._open_vectors()
+                with open(self._words_path, encoding="utf-8") as f:
+                    words = f.read().split("\n")[:-1][: self._vectors.shape[0]]
+
+            # Drop words listed without a vector so that appended rows stay aligned
+            data = "".join(word + "\n" for word in words).encode("utf-8")
+            with open(self._words_path, "wb") as f:
+                f.write(data)
+            self._words_offset = len(data)
+            for row, word in enumerate(words):
+                self.rows[word] = row
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @contextmanager
+    def _locked(self):
+        with open(self._lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _open_vectors(self) -> None:
+        self._vectors = np.load(self._vectors_path, mmap_mode="r+")
+        self._vectors_inode = os.stat(self._vectors_path).st_ino
+
+    def _sync(self) -> None:
+        # Rows added by other processes: their vectors are already in the shared mapping unless
+        # the matrix was grown into a new file
+        if os.path.exists(self._vectors_path) and os.stat(self._vectors_path).st_ino != self._vectors_inode:
+            self._open_vectors()
+        with open(self._words_path, "rb") as f:
+            f.seek(self._words_offset)
+            data = f.read()
+        self._words_offset += len(data)
+        for word in data.decode("utf-8").split("\n")[:-1]:
+            self.rows[word] = len(self.rows)
+
+    def _reserve(self, size: int, dim: int) -> None:
+        capacity = 0 if self._vectors is None else self._vectors.shape[0]
+        if capacity >= size:
+            return
+
+        tmp_path = self._vectors_path + ".tmp"
+        grown = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=np.float16, shape=(max(size, 2 * capacity, 1024), dim)
+        )
+        if self._vectors is not None:
+            grown[: len(self)] = self._vectors[: len(self)]
+        grown.flush()
+        os.replace(tmp_path, self._vectors_path)
+        self._vectors = grown
+        self._vectors_inode = os.stat(self._vectors_path).st_ino
+
+    def _add(self, words: list[str], vectors: np.ndarray) -> None:
+        start = len(self)
+        self._reserve(start + len(words), vectors.shape[1])
+        self._vectors[start : start + len(words)] = vectors
+        self._vectors.flush()
+        data = "".join(word + "\n" for word in words).encode("utf-8")
+        with open(self._words_path, "ab") as f:
+            f.write(data)
+        self._words_offset += len(data)
+        for row, word in enumerate(words, start):
+            self.rows[word] = row
+
+    def lookup(self, words: list[str], embed: Callable[[list[str]], np.ndarray]) -> np.ndarray:
+        """float32 vectors of words; only the words never seen before are passed to embed."""
+        missing = [word for word in dict.fromkeys(words) if word not in self.rows]
+        if missing:
+            vectors = embed(missing)
+            with self._locked():
+                self._sync()
+                new = [i for i, word in enumerate(missing) if word not in self.rows]
+                if new:
+                    self._add([missing[i] for i in new], vectors[new])
+        return np.asarray(self._vectors[[self.rows[word] for word in words]], dtype=np.float32)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+class KeywordExtractor:
+    """
+    KeyBERT-style keyword extraction: the candidate words of a transcript, ranked by cosine
+    similarity of their embeddings to the embedding of the whole transcript.
+
+    Candidates are the unigrams found by CountVectorizer's default analyzer, as in KeyBERT with
+    keyphrase_ngram_range=(1, 1) and no stop words. Word vectors come from a WordEmbeddingStore,
+    so only words never seen before go through the transformer, and each transcript is scored
+    with a single matmul.
+    """
+
+    def __init__(self, embedder: BatchedFlairEmbedder, store: WordEmbeddingStore):
+        self.embedder = embedder
+        self.store = store
+        self.analyzer = CountVectorizer(ngram_range=(1, 1), stop_words=None).build_analyzer()
+
+    def extract_batch(self, transcripts: list[str]) -> list[list[str]]:
+        """
+        Keywords of each transcript, best first. Transcripts are embedded together and the unseen
+        words of all of them are embedded together.
+        """
+        results = [[] for _ in transcripts]
+        indices = [i for i, transcript in enumerate(transcripts) if transcript.strip()]
+        if not indices:
+            return results
+
+        candidates = [list(dict.fromkeys(self.analyzer(transcripts[i]))) for i in indices]
+        vocabulary = list(dict.fromkeys(word for words in candidates for word in words))
+        if not vocabulary:
+            return results
+        rows = {word: row for row, word in enumerate(vocabulary)}
+
+        doc_embeddings = _normalize(self.embedder.embed([transcripts[i] for i in indices]))
+        word_embeddings = _normalize(self.store.lookup(vocabulary, self.embedder.embed))
+
+        for i, words, doc_embedding in zip(indices, candidates, doc_embeddings):
+            if not words:
+                continue
+            scores = word_embeddings[[rows[word] for word in words]] @ doc_embedding
+            results[i] = [words[j] for j in np.argsort(-scores, kind="stable")[:TOP_N]]
+        return results
+
+
+def load_keyword_model(path: str, batch_size: int, store_dir: str) -> KeywordExtractor:
+    embedder = BatchedFlairEmbedder(TransformerDocumentEmbeddings(path), batch_size)
+    return KeywordExtractor(embedder, WordEmbeddingStore(store_dir))
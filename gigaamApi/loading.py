@@ -0,0 +1,78 @@
+import threading
+import time
+from typing import Any, Callable, Optional
+
+
+class ModelLoader:
+    """
+    Loads a model on a background thread and keeps track of its progress.
+
+    start() begins loading; get() starts it if nothing has yet, blocks until the model is loaded and
+    returns it, or raises if loading failed. Warmup is run by the owner of the model, usually through
+    the worker that drives it, and reported with warmed_up() or warmup_failed(). Load and warmup
+    times and errors are shown by the /health and /ready endpoints.
+    """
+
+    def __init__(self, name: str, load: Callable[[], Any]):
+        self.name = name
+        self._load = load
+        self._lock = threading.Lock()
+        self._loaded = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._model = None
+        self._error: Optional[BaseException] = None
+        self._warmup_error: Optional[BaseException] = None
+        self.load_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"load-{self.name}", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        started = time.perf_counter()
+        try:
+            self._model = self._load()
+        except BaseException as e:
+            self._error = e
+        self.load_seconds = time.perf_counter() - started
+        self._loaded.set()
+
+    def get(self) -> Any:
+        self.start()
+        self._loaded.wait()
+        if self._error is not None:
+            raise RuntimeError(f"Loading the {self.name} model failed: {self._error}") from self._error
+        return self._model
+
+    def warmed_up(self, seconds: float) -> None:
+        self.warmup_seconds = seconds
+
+    def warmup_failed(self, error: BaseException) -> None:
+        self._warmup_error = error
+
+    @property
+    def ready(self) -> bool:
+        return self.warmup_seconds is not None
+
+    def status(self) -> dict:
+        error = self._error or self._warmup_error
+        if error is not None:
+            state = "failed"
+        elif self.ready:
+            state = "ready"
+        elif self._loaded.is_set():
+            state = "warming_up"
+        elif self._thread is not None:
+            state = "loading"
+        else:
+            state = "not_loaded"
+
+        status = {"state": state, "load_seconds": self.load_seconds, "warmup_seconds": self.warmup_seconds}
+        if self._error is not None:
+            status["error"] = str(self._error)
+        elif self._warmup_error is not None:
+            status["error"] = f"Warmup failed: {self._warmup_error}"
+        return status
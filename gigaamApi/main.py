@@ -1,97 +1,384 @@
+import asyncio
+import base64
+import functools
+import json
+import time
+from typing import Any, Optional, Union
+
 import torch
-import torchaudio
-import requests
-import tempfile
-import os
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from nemo.collections.asr.models import EncDecRNNTBPEModel
-
-from nemo.collections.asr.modules.audio_preprocessing import (
-    AudioToMelSpectrogramPreprocessor as NeMoAudioToMelSpectrogramPreprocessor,
-)
-from nemo.collections.asr.parts.preprocessing.features import (
-    FilterbankFeaturesTA as NeMoFilterbankFeaturesTA,
-)
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 
-from keybert import KeyBERT
-from flair.embeddings import TransformerDocumentEmbeddings
+from .audio import SAMPLE_RATE, NoAudioTrack, fetch_validator, load_audio, pcm_digest
+from .cache import TranscriptCache
+from .config import (
+    CACHE_DIR,
+    CACHE_MAX_MB,
+    CACHE_MEMORY_ITEMS,
+    EMBED_BATCH_SIZE,
+    EMBED_CACHE_ITEMS,
+    EMBED_MAX_TEXTS,
+    EMBEDDING_STORE_DIR,
+    KEYWORDS_BUDGET_SECONDS,
+    KEYWORDS_MAX_BATCH_SIZE,
+    KEYWORDS_MODEL,
+    MAX_BATCH_SIZE,
+    MAX_BATCH_WAIT,
+    MODEL_PROFILE,
+    ONNX_DIR,
+    ONNX_THREADS,
+    NO_SPEECH_MIN_MODULATION_DB,
+    NO_SPEECH_MIN_SECONDS,
+    SEGMENT_MAX_SECONDS,
+)
+from .executor import BatchingWorker
+from .keywords import CachedEmbedder, load_keyword_model
+from .loading import ModelLoader
+from . import metrics
+from .metrics import AUDIO_SECONDS, IN_FLIGHT, MODEL_INFO, QUEUE_DEPTH, REALTIME_FACTOR, REQUEST_SECONDS, timed
+from .vad import has_speech, sample_windows, split_on_silence
 
 app = FastAPI()
 
 class TranscribeRequest(BaseModel):
     url: str
 
+class KeywordsRequest(TranscribeRequest):
+    # Seconds of audio to transcribe for keyword extraction, see sample_windows; 0 for all of it
+    budget_seconds: Optional[float] = Field(None, ge=0)
+
 class TranscribeResponse(BaseModel):
     result: str = None
+    no_speech: bool = False
+    error: str = None
+
+class EmbedRequest(BaseModel):
+    texts: list[str]
+    # float for lists of numbers, base64 for the little-endian float16 bytes of each vector
+    encoding: str = "float"
+
+class EmbedResponse(BaseModel):
+    result: Union[list[list[float]], list[str]] = None
+    dim: int = None
     error: str = None
 
 class KeywordsResponse(BaseModel):
     result: list[str] = None
+    no_speech: bool = False
+    coverage: float = 1.0
     error: str = None
 
-# Load model
-device = "cuda" if torch.cuda.is_available() else "cpu"
-model = EncDecRNNTBPEModel.from_config_file("./rnnt_model_config.yaml")
-ckpt = torch.load("./rnnt_model_weights.ckpt", map_location="cpu")
-model.load_state_dict(ckpt, strict=False)
-model.eval()
-model = model.to(device)
+device = "cuda" if torch.cuda.is_available() and MODEL_PROFILE == "fp32" else "cpu"
+
+def load_rnnt():
+    # The onnx profile does not import NeMo at all
+    if MODEL_PROFILE == "onnx":
+        from .onnx_backend import OnnxTranscriber
+
+        return OnnxTranscriber(ONNX_DIR, ONNX_THREADS).transcribe_batch
+
+    from .inference import load_model, transcribe_batch
+
+    return functools.partial(transcribe_batch, load_model(device, MODEL_PROFILE))
+
+def run_transcription(signals: list[torch.Tensor]) -> list[str]:
+    AUDIO_SECONDS.inc(sum(signal.shape[0] for signal in signals) / SAMPLE_RATE, worker="rnnt")
+    return rnnt_model.get()(signals)
+
+def load_keywords():
+    #extractor = load_keyword_model('cointegrated/rubert-tiny2', EMBED_BATCH_SIZE, EMBEDDING_STORE_DIR)
+    #extractor = load_keyword_model('DeepPavlov/rubert-base-cased', EMBED_BATCH_SIZE, EMBEDDING_STORE_DIR)
+    extractor = load_keyword_model('/workspace/data/models/ruBert-base', EMBED_BATCH_SIZE, EMBEDDING_STORE_DIR)
+    return {"keywords": extractor.extract_batch, "embed": CachedEmbedder(extractor.embedder, EMBED_CACHE_ITEMS).embed_batch}
+
+def run_text_jobs(jobs: list[tuple[str, Any]]) -> list[Any]:
+    # Keyword extraction and /embed share ruBert and its thread; jobs of each kind are run as one batch
+    runners = kw_model.get()
+    results = [None] * len(jobs)
+    for kind, run in runners.items():
+        indices = [i for i, (job_kind, _) in enumerate(jobs) if job_kind == kind]
+        if indices:
+            for i, result in zip(indices, run([jobs[i][1] for i in indices])):
+                results[i] = result
+    return results
+
+# Models load concurrently in the background while the server already answers /health; requests
+# arriving before a model is loaded wait for it in its worker's queue
+rnnt_model = ModelLoader("rnnt", load_rnnt)
+rnnt_model.start()
+kw_model = ModelLoader("keywords", load_keywords) if KEYWORDS_MODEL != "off" else None
+if KEYWORDS_MODEL == "eager":
+    kw_model.start()
+
+# Each model is driven by its own thread, so the event loop keeps serving while they run and
+# downloading/decoding the next request overlaps inference of the current one. Concurrent
+# transcriptions and keyword extractions are coalesced into batches.
+transcriber = BatchingWorker(
+    "rnnt",
+    run_transcription,
+    max_batch_size=MAX_BATCH_SIZE,
+    max_wait=MAX_BATCH_WAIT,
+)
+keyword_worker = BatchingWorker(
+    "keybert",
+    run_text_jobs,
+    max_batch_size=KEYWORDS_MAX_BATCH_SIZE,
+    max_wait=MAX_BATCH_WAIT,
+) if kw_model else None
+
+# (loader, worker, input) of each model that is warmed up at startup
+warmups = [(rnnt_model, transcriber, torch.zeros(SAMPLE_RATE))]
+if KEYWORDS_MODEL == "eager":
+    warmups.append((kw_model, keyword_worker, ("keywords", "проверка")))
+
+def wait_loaded():
+    """Block until the models loaded at startup are loaded or have failed."""
+    for loader, _, _ in warmups:
+        try:
+            loader.get()
+        except RuntimeError:
+            pass
+
+async def warm_up():
+    # One inference per model in every server process before it reports ready, through the
+    # worker thread that will run the model
+    for loader, worker, item in warmups:
+        try:
+            await asyncio.to_thread(loader.get)
+        except RuntimeError:
+            # The loader reports the failure
+            continue
+        try:
+            started = time.perf_counter()
+            await worker.submit(item)
+            loader.warmed_up(time.perf_counter() - started)
+        except Exception as e:
+            loader.warmup_failed(e)
+
+@app.on_event("startup")
+async def start_warm_up():
+    app.state.warm_up = asyncio.create_task(warm_up())
+    # Set in each server process, pre-forked workers pick their thread count after the fork
+    threads = ONNX_THREADS if MODEL_PROFILE == "onnx" else torch.get_num_threads()
+    MODEL_INFO.set(1, profile=MODEL_PROFILE, device=device, threads=threads)
+
+QUEUE_DEPTH.set_function(lambda: transcriber.queue_depth, worker=transcriber.name)
+if keyword_worker:
+    QUEUE_DEPTH.set_function(lambda: keyword_worker.queue_depth, worker=keyword_worker.name)
+REALTIME_FACTOR.set_function(lambda: metrics.realtime_factor(transcriber.name), worker=transcriber.name)
+
+cache = TranscriptCache(CACHE_DIR, int(CACHE_MAX_MB * 1024 * 1024), CACHE_MEMORY_ITEMS)
+no_speech_count = 0
+
+async def transcribe(audio: torch.Tensor) -> str:
+    # Long audio is split at pauses; the segments are batched like independent requests and
+    # their texts are joined back in order
+    segments = await asyncio.to_thread(split_on_silence, audio, SEGMENT_MAX_SECONDS)
+    texts = await asyncio.gather(*(transcriber.submit(segment) for segment in segments))
+    return " ".join(text for text in texts if text)
+
+async def is_silent(audio: torch.Tensor) -> bool:
+    global no_speech_count
+    # Silent and noise-only videos are answered without occupying the transcriber
+    if NO_SPEECH_MIN_SECONDS <= 0:
+        return False
+    with timed("vad"):
+        speech = await asyncio.to_thread(has_speech, audio, NO_SPEECH_MIN_SECONDS, NO_SPEECH_MIN_MODULATION_DB)
+    if not speech:
+        no_speech_count += 1
+    return not speech
 
-#embedding_model = TransformerDocumentEmbeddings('cointegrated/rubert-tiny2')
-#embedding_model = TransformerDocumentEmbeddings('DeepPavlov/rubert-base-cased')
-embedding_model = TransformerDocumentEmbeddings('/workspace/data/models/ruBert-base')
+def no_speech_entry() -> dict:
+    return {"transcript": "", "keywords": [], "no_speech": True}
 
+async def analyze(audio: torch.Tensor, budget_seconds: Optional[float]) -> dict:
+    if await is_silent(audio):
+        return no_speech_entry()
+
+    # With a budget only windows from the start, middle and end of long audio are transcribed
+    windows = sample_windows(audio, budget_seconds, SEGMENT_MAX_SECONDS) if budget_seconds and budget_seconds > 0 else [audio]
+    texts = await asyncio.gather(*(transcribe(window) for window in windows))
+    entry = {"transcript": " ".join(text for text in texts if text)}
+    if windows[0] is not audio:
+        entry["coverage"] = sum(window.shape[0] for window in windows) / audio.shape[0]
+    return entry
+
+async def lookup(url: str) -> tuple[list[str], Optional[dict], Optional[torch.Tensor]]:
+    """Cache keys of the video, its cached entry if any, and its audio unless the URL key hit."""
+    global no_speech_count
+    # Results are cached under the URL with its ETag/Last-Modified, so a repeated request for an
+    # unchanged video costs one HEAD request, and under a hash of the decoded PCM, which covers
+    # hosts without validators and the same video behind different URLs
+    validator = await fetch_validator(url)
+    keys = [f"url:{url}|{validator}"] if validator else []
+    # A lookup counts as one hit or one miss in /stats, whichever keys it tries
+    entry = await asyncio.to_thread(cache.get, keys[0], count_miss=False) if keys else None
+    if entry is not None:
+        return keys, entry, None
+
+    try:
+        audio = await load_audio(url)
+    except NoAudioTrack:
+        # Answered like silence, and cached under the URL key as there is no PCM to hash
+        no_speech_count += 1
+        cache.count_miss()
+        entry = no_speech_entry()
+        for key in keys:
+            await asyncio.to_thread(cache.put, key, entry)
+        return keys, entry, None
+    keys.append("pcm:" + await asyncio.to_thread(pcm_digest, audio))
+    return keys, await asyncio.to_thread(cache.get, keys[-1]), audio
+
+async def process(url: str, with_keywords: bool, budget_seconds: Optional[float] = None) -> dict:
+    if with_keywords and keyword_worker is None:
+        raise ValueError("Keyword extraction is disabled")
+    keys, entry, audio = await lookup(url)
+    if entry is None:
+        entry = await analyze(audio, budget_seconds)
+    elif audio is None and (not with_keywords or "keywords" in entry):
+        return entry
+
+    if with_keywords and "keywords" not in entry:
+        entry["keywords"] = await keyword_worker.submit(("keywords", entry["transcript"]))
+    # Partial transcripts are not cached, a later request may have a bigger budget
+    if "coverage" not in entry:
+        for key in keys:
+            await asyncio.to_thread(cache.put, key, entry)
+    return entry
+
+ENDPOINTS = {"/transcribe", "/transcribe-stream", "/transcribe-keywords", "/embed"}
+
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+    endpoint = request.url.path
+    if endpoint not in ENDPOINTS:
+        return await call_next(request)
+    IN_FLIGHT.inc(endpoint=endpoint)
+    try:
+        with REQUEST_SECONDS.time(endpoint=endpoint):
+            response = await call_next(request)
+    except BaseException:
+        IN_FLIGHT.dec(endpoint=endpoint)
+        raise
+
+    # A request is in flight until its body is sent, which for /transcribe-stream is when the
+    # last segment is transcribed, not when the headers are
+    async def body(chunks):
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            IN_FLIGHT.dec(endpoint=endpoint)
+
+    response.body_iterator = body(response.body_iterator)
+    return response
 
-kw_model = KeyBERT(model=embedding_model)
 @app.post("/transcribe", response_model=TranscribeResponse)
 async def transcribe_audio(request: TranscribeRequest):
     try:
-        # Download the video
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as tmp_file:
-            video_path = tmp_file.name
-            response = requests.get(request.url)
-            tmp_file.write(response.content)
-        
-        # Extract audio
-        audio_path = video_path.replace(".mp4", ".wav")
-        os.system(f"ffmpeg  -hide_banner -loglevel error -i {video_path} -ac 1 -ar 16000 {audio_path}")
-
-        # Transcribe audio
-        result = model.transcribe([audio_path])[0]
-
-        # Clean up
-        os.remove(video_path)
-        os.remove(audio_path)
-        
-        return TranscribeResponse(result=result[0])
+        entry = await process(request.url, with_keywords=False)
+        return TranscribeResponse(result=entry["transcript"], no_speech=entry.get("no_speech", False))
     except Exception as e:
         return TranscribeResponse(error=str(e))
 
+def sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def stream_transcription(url: str):
+    # Every segment is queued at once so they are batched as usual, and each text is sent as soon
+    # as it and the segments before it are done. Segments still queued when the client
+    # disconnects are cancelled.
+    futures = []
+    try:
+        keys, entry, audio = await lookup(url)
+        if entry is None and await is_silent(audio):
+            entry = no_speech_entry()
+        elif entry is None:
+            segments = await asyncio.to_thread(split_on_silence, audio, SEGMENT_MAX_SECONDS)
+            futures = [transcriber.submit(segment) for segment in segments]
+            texts = []
+            start = 0
+            for index, (segment, future) in enumerate(zip(segments, futures)):
+                texts.append(await future)
+                end = start + segment.shape[0]
+                yield sse("segment", {
+                    "index": index,
+                    "start": start / SAMPLE_RATE,
+                    "end": end / SAMPLE_RATE,
+                    "text": texts[-1],
+                })
+                start = end
+            entry = {"transcript": " ".join(text for text in texts if text)}
+        if audio is not None:
+            for key in keys:
+                await asyncio.to_thread(cache.put, key, entry)
+        yield sse("done", {"result": entry["transcript"], "no_speech": entry.get("no_speech", False)})
+    except Exception as e:
+        yield sse("error", {"error": str(e)})
+    finally:
+        for future in futures:
+            future.cancel()
+
+@app.post("/transcribe-stream")
+async def transcribe_stream(request: TranscribeRequest):
+    return StreamingResponse(
+        stream_transcription(request.url),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.post("/transcribe-keywords", response_model=KeywordsResponse)
-async def transcribe_keywords(request: TranscribeRequest):
+async def transcribe_keywords(request: KeywordsRequest):
     try:
-        # Download the video
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as tmp_file:
-            video_path = tmp_file.name
-            response = requests.get(request.url)
-            tmp_file.write(response.content)
-        
-        # Extract audio
-        audio_path = video_path.replace(".mp4", ".wav")
-        os.system(f"ffmpeg  -hide_banner -loglevel error -i {video_path} -ac 1 -ar 16000 {audio_path}")
-
-        # Transcribe audio
-        transcription = model.transcribe([audio_path])[0][0]
-        weighted_keywords = kw_model.extract_keywords(transcription, keyphrase_ngram_range=(1, 1), stop_words=None)
-        weighted_keywords.sort(key=lambda x: x[1], reverse=True)
-        
-        result = [tup[0] for tup in weighted_keywords]
-
-        # Clean up
-        os.remove(video_path)
-        os.remove(audio_path)
-        
-        return KeywordsResponse(result=result)
+        budget_seconds = request.budget_seconds if request.budget_seconds is not None else KEYWORDS_BUDGET_SECONDS
+        entry = await process(request.url, with_keywords=True, budget_seconds=budget_seconds)
+        return KeywordsResponse(
+            result=entry["keywords"],
+            no_speech=entry.get("no_speech", False),
+            coverage=entry.get("coverage", 1.0),
+        )
     except Exception as e:
         return KeywordsResponse(error=str(e))
+
+@app.post("/embed", response_model=EmbedResponse)
+async def embed(request: EmbedRequest):
+    try:
+        if keyword_worker is None:
+            raise ValueError("Keyword extraction is disabled")
+        if not 0 < len(request.texts) <= EMBED_MAX_TEXTS:
+            raise ValueError(f"Expected 1 to {EMBED_MAX_TEXTS} texts")
+        if request.encoding not in ("float", "base64"):
+            raise ValueError("encoding must be float or base64")
+
+        vectors = await keyword_worker.submit(("embed", request.texts))
+        if request.encoding == "base64":
+            result = [base64.b64encode(vector.astype("<f2").tobytes()).decode("ascii") for vector in vectors]
+        else:
+            result = vectors.tolist()
+        return EmbedResponse(result=result, dim=vectors.shape[1])
+    except Exception as e:
+        return EmbedResponse(error=str(e))
+
+def model_status() -> dict:
+    return {loader.name: loader.status() for loader in (rnnt_model, kw_model) if loader}
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "models": model_status()}
+
+@app.get("/ready")
+async def ready():
+    is_ready = all(loader.ready for loader, _, _ in warmups)
+    return JSONResponse(
+        {"ready": is_ready, "models": model_status()},
+        status_code=200 if is_ready else 503,
+    )
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats")
+async def stats():
+    return {"cache": await asyncio.to_thread(cache.stats), "no_speech": no_speech_count}
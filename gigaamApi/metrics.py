@@ -0,0 +1,169 @@
+"""
+Minimal Prometheus metrics, rendered in the text exposition format by /metrics.
+
+Each metric keeps its values per label set behind its own lock, so recording costs a dict update
+and metrics can be recorded from the event loop and the inference threads alike. Values are per
+process: with several server workers each one reports its own.
+"""
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_registry: list["Metric"] = []
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _samples(self) -> list[tuple[str, tuple, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0.0)
+
+    def _samples(self):
+        with self._lock:
+            return [("_total", key, value) for key, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """A value that is set directly, or read from callback when rendered."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._callbacks: dict[tuple, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, callback: Callable[[], float], **labels) -> None:
+        self._callbacks[tuple(sorted(labels.items()))] = callback
+
+    def _samples(self):
+        with self._lock:
+            samples = [("", key, value) for key, value in self._values.items()]
+        return samples + [("", key, callback()) for key, callback in self._callbacks.items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (math.inf,), counts):
+                    cumulative += count
+                    samples.append(("_bucket", key + (("le", _format_value(bound)),), cumulative))
+                samples.append(("_sum", key, total))
+                samples.append(("_count", key, cumulative))
+        return samples
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+# Stages are validator (HEAD request), decode_wait (waiting for a download + decoder slot),
+# download (until the last byte of the body is passed to the decoder), decode (decoding left after
+# the download, or all of it when the decoder reads the URL itself, by PyAV or ffmpeg as
+# GIGAAM_AUDIO_DECODER selects), vad, <worker>_queue (from submit until the batch starts) and
+# <worker> (the batch itself)
+STAGE_SECONDS = Histogram("gigaam_stage_seconds", "Time spent in each processing stage.")
+REQUEST_SECONDS = Histogram("gigaam_request_seconds", "Time to response headers by endpoint.")
+IN_FLIGHT = Gauge("gigaam_requests_in_flight", "Requests being processed by endpoint.")
+QUEUE_DEPTH = Gauge("gigaam_queue_depth", "Items waiting for an inference worker.")
+BATCH_SIZE = Histogram("gigaam_batch_size", "Items per inference batch.", buckets=(1, 2, 4, 8, 16, 32, 64))
+AUDIO_SECONDS = Counter("gigaam_audio_seconds", "Seconds of audio transcribed.")
+INFERENCE_SECONDS = Counter("gigaam_inference_seconds", "Wall seconds spent in inference batches.")
+REALTIME_FACTOR = Gauge(
+    "gigaam_realtime_factor", "Seconds of audio transcribed per second of transcription since start."
+)
+DOWNLOAD_BYTES = Counter("gigaam_download_bytes", "Bytes of video downloaded and passed to the decoder.")
+MODEL_INFO = Gauge("gigaam_model_info", "Model profile, device and intra-op threads of this process.")
+
+
+def realtime_factor(worker: str) -> float:
+    seconds = INFERENCE_SECONDS.value(worker=worker)
+    return AUDIO_SECONDS.value(worker=worker) / seconds if seconds else 0.0
+
+
+def timed(stage: str):
+    return STAGE_SECONDS.time(stage=stage)
@@ -0,0 +1,147 @@
+import os
+
+import numpy as np
+import onnxruntime as ort
+import sentencepiece
+import torch
+
+ENCODER = "encoder.onnx"
+DECODER = "decoder.onnx"
+JOINT = "joint.onnx"
+PARAMS = "params.npz"
+TOKENIZER = "tokenizer.model"
+
+
+class OnnxTranscriber:
+    """
+    Greedy RNNT transcription on onnxruntime, without NeMo.
+
+    Loads the encoder, the prediction network and the joint network exported by export_onnx.py,
+    along with the mel filterbank, the STFT window, the front-end settings and the tokenizer. The
+    mel front-end is the same computation as preprocessor.FilterbankFeaturesTA in plain torch,
+    with the STFT padding, magnitude power, log guard and frame padding of the exported config
+    (export_onnx.py refuses configs with pre-emphasis or normalization), and decoding follows NeMo's
+    greedy_batch: per encoder frame, up to max_symbols tokens are emitted until blank.
+
+    Sessions use intra_op_threads threads for each operator and run operators sequentially.
+    """
+
+    def __init__(self, directory: str, intra_op_threads: int):
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        def session(name: str) -> ort.InferenceSession:
+            return ort.InferenceSession(
+                os.path.join(directory, name), options, providers=["CPUExecutionProvider"]
+            )
+
+        self.encoder = session(ENCODER)
+        self.decoder = session(DECODER)
+        self.joint = session(JOINT)
+        self.tokenizer = sentencepiece.SentencePieceProcessor(
+            model_file=os.path.join(directory, TOKENIZER)
+        )
+
+        params = np.load(os.path.join(directory, PARAMS))
+        missing = {"center", "pad_mode", "mag_power", "log", "log_zero_guard_type", "pad_to", "pad_value"} - set(params.files)
+        if missing:
+            raise ValueError(f"{PARAMS} lacks {', '.join(sorted(missing))}, export the model again with export_onnx.py")
+        self.window = torch.from_numpy(params["window"])
+        self.mel_fb = torch.from_numpy(params["mel_fb"])
+        self.n_fft, self.hop_length, self.win_length = (int(x) for x in params["stft"])
+        self.center = bool(params["center"])
+        self.pad_mode = str(params["pad_mode"])
+        self.mag_power = float(params["mag_power"])
+        self.log = bool(params["log"])
+        self.log_zero_guard_type = str(params["log_zero_guard_type"])
+        self.log_zero_guard = float(params["log_zero_guard"])
+        self.pad_to = int(params["pad_to"])
+        self.pad_value = float(params["pad_value"])
+        self.blank = int(params["blank"])
+        self.max_symbols = int(params["max_symbols"])
+        self.state_shape = tuple(int(x) for x in params["state_shape"])
+
+    def featurize(self, signal: torch.Tensor, lengths: torch.Tensor) -> tuple[np.ndarray, np.ndarray]:
+        stft = torch.stft(
+            signal,
+            n_fft=self.n_fft,
+            hop_length=self.hop_length,
+            win_length=self.win_length,
+            window=self.window,
+            center=self.center,
+            pad_mode=self.pad_mode,
+            return_complex=True,
+        )
+        power = torch.view_as_real(stft).pow_(2).sum(dim=-1)
+        if self.mag_power != 2.0:
+            power = power.pow_(self.mag_power / 2)
+        features = torch.matmul(self.mel_fb, power)
+        if self.log:
+            if self.log_zero_guard_type == "add":
+                features = features.add_(self.log_zero_guard)
+            else:
+                features = features.clamp_(min=self.log_zero_guard)
+            features = features.log_()
+
+        if self.center:
+            features_len = lengths.div(self.hop_length, rounding_mode="floor") + 1
+        else:
+            features_len = (lengths - self.n_fft).div(self.hop_length, rounding_mode="floor") + 1
+        padding = torch.arange(features.shape[-1])[None, :] >= features_len[:, None]
+        features.masked_fill_(padding[:, None, :], self.pad_value)
+        if self.pad_to > 0 and features.shape[-1] % self.pad_to:
+            features = torch.nn.functional.pad(
+                features, (0, self.pad_to - features.shape[-1] % self.pad_to), value=self.pad_value
+            )
+        return features.numpy(), features_len.numpy()
+
+    def _predict(self, tokens: np.ndarray, states: list[np.ndarray]) -> tuple[np.ndarray, list[np.ndarray]]:
+        prediction, h, c = self.decoder.run(None, {"tokens": tokens[:, None], "h": states[0], "c": states[1]})
+        return prediction, [h, c]
+
+    def _joint(self, frame: np.ndarray, prediction: np.ndarray) -> np.ndarray:
+        logits = self.joint.run(None, {"encoder_frame": frame, "prediction": prediction})[0]
+        return logits.argmax(axis=1)
+
+    def _greedy_decode(self, encoded: np.ndarray, encoded_len: np.ndarray) -> list[list[int]]:
+        batch = encoded.shape[0]
+        frames = np.ascontiguousarray(encoded.transpose(2, 0, 1))  # [T, B, D]
+        hypotheses = [[] for _ in range(batch)]
+
+        # The blank token is the start-of-sequence input of the prediction network
+        layers, hidden = self.state_shape
+        states = [np.zeros((layers, batch, hidden), dtype=np.float32) for _ in range(2)]
+        prediction, states = self._predict(np.full(batch, self.blank, dtype=np.int64), states)
+
+        for t in range(int(encoded_len.max())):
+            emitting = encoded_len > t
+            for _ in range(self.max_symbols):
+                tokens = self._joint(frames[t], prediction)
+                emitting &= tokens != self.blank
+                if not emitting.any():
+                    break
+                for b in np.flatnonzero(emitting):
+                    hypotheses[b].append(int(tokens[b]))
+
+                # Only rows that emitted a token advance the prediction network
+                new_prediction, new_states = self._predict(tokens.astype(np.int64), states)
+                prediction = np.where(emitting[:, None], new_prediction, prediction)
+                states = [np.where(emitting[None, :, None], new, old) for new, old in zip(new_states, states)]
+        return hypotheses
+
+    def transcribe_tensor(self, signal: torch.Tensor, lengths: torch.Tensor) -> list[str]:
+        """Same contract as inference.transcribe_tensor."""
+        features, features_len = self.featurize(signal, lengths)
+        inputs = [features, features_len.astype(np.int64)]
+        encoded, encoded_len = self.encoder.run(
+            None, {i.name: x for i, x in zip(self.encoder.get_inputs(), inputs)}
+        )[:2]
+        return [self.tokenizer.decode(tokens) for tokens in self._greedy_decode(encoded, encoded_len)]
+
+    def transcribe_batch(self, signals: list[torch.Tensor]) -> list[str]:
+        lengths = torch.tensor([signal.shape[0] for signal in signals], dtype=torch.long)
+        signal = torch.nn.utils.rnn.pad_sequence(signals, batch_first=True)
+        return self.transcribe_tensor(signal, lengths)
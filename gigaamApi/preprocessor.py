@@ -33,6 +33,38 @@ class FilterbankFeaturesTA(NeMoFilterbankFeaturesTA):
             )
         )
 
+        # The window and the mel filterbank are kept as buffers, so they move to the model device
+        # once with the module and each batch only needs its waveforms on the device
+        self.register_buffer("stft_window", self._mel_spec_extractor.spectrogram.window, persistent=False)
+        self.register_buffer(
+            "mel_fb", self._mel_spec_extractor.mel_scale.fb.T.contiguous(), persistent=False
+        )
+
+    def _extract_spectrograms(self, signals: torch.Tensor) -> torch.Tensor:
+        """
+        Mel power spectrogram [B, n_mels, T] of a padded batch of waveforms [B, samples].
+
+        Same result as self._mel_spec_extractor, but computes |X|^2 directly from the real and
+        imaginary parts instead of abs() followed by pow(2), and projects the whole batch onto the
+        filterbank with one matmul.
+        """
+        spectrogram = self._mel_spec_extractor.spectrogram
+        # Complex FFT needs to be done in single precision
+        with torch.cuda.amp.autocast(enabled=False):
+            stft = torch.stft(
+                signals,
+                n_fft=spectrogram.n_fft,
+                hop_length=spectrogram.hop_length,
+                win_length=spectrogram.win_length,
+                window=self.stft_window,
+                center=spectrogram.center,
+                pad_mode=spectrogram.pad_mode,
+                onesided=spectrogram.onesided,
+                return_complex=True,
+            )
+            power = torch.view_as_real(stft).pow_(2).sum(dim=-1)
+            return torch.matmul(self.mel_fb, power)
+
 
 class AudioToMelSpectrogramPreprocessor(NeMoAudioToMelSpectrogramPreprocessor):
     def __init__(self, mel_scale: str = "htk", **kwargs):
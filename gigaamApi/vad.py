@@ -0,0 +1,132 @@
+import math
+
+import torch
+import torch.nn.functional as F
+
+from .audio import SAMPLE_RATE
+
+FRAME_SECONDS = 0.02
+FRAME_SIZE = int(FRAME_SECONDS * SAMPLE_RATE)
+
+
+def frame_energy(audio: torch.Tensor, smoothing_seconds: float = 0.0) -> torch.Tensor:
+    """Mean power of each 20 ms frame, optionally averaged over a centered window."""
+    num_frames = audio.shape[0] // FRAME_SIZE
+    energy = audio[: num_frames * FRAME_SIZE].view(num_frames, FRAME_SIZE).pow(2).mean(dim=1)
+
+    width = int(smoothing_seconds / FRAME_SECONDS) // 2 * 2 + 1
+    if width > 1 and num_frames > 0:
+        energy = F.avg_pool1d(
+            energy[None, None], width, stride=1, padding=width // 2, count_include_pad=False
+        )[0, 0]
+    return energy
+
+
+def split_on_silence(audio: torch.Tensor, max_seconds: float) -> list[torch.Tensor]:
+    """
+    Cut a 16 kHz waveform into consecutive segments of at most max_seconds.
+
+    Each cut is placed at the quietest point (by energy smoothed over 200 ms, i.e. in a pause
+    between words rather than a gap between phonemes) in the second half of the allowed
+    window, so every segment is at least max_seconds / 2 long except possibly the last one.
+    Segments are views into audio, nothing is copied.
+    """
+    # At least 2 frames, so that every cut is past the start of its segment
+    max_frames = max(int(max_seconds / FRAME_SECONDS), 2)
+    if audio.shape[0] <= max_frames * FRAME_SIZE:
+        return [audio]
+
+    energy = frame_energy(audio, smoothing_seconds=0.2)
+    segments = []
+    start = 0
+    while energy.shape[0] - start > max_frames:
+        window_start = start + max_frames // 2
+        cut = window_start + int(torch.argmin(energy[window_start : start + max_frames]))
+        segments.append(audio[start * FRAME_SIZE : cut * FRAME_SIZE])
+        start = cut
+    segments.append(audio[start * FRAME_SIZE :])
+    return segments
+
+
+# Frames quieter than this are silence; louder frames with a spectrum flatter than this are
+# noise-like (hiss, wind, applause) rather than voiced
+SPEECH_MIN_ENERGY_DB = -50.0
+SPEECH_MAX_FLATNESS = 0.4
+GATE_BLOCK_FRAMES = 500
+# Speech rises and falls with its syllables, about 4 times a second: the frame energy in dB,
+# band-passed to 2-8 Hz, varies by several dB. Sustained music stays within a dB or two.
+SYLLABLE_RATE_HZ = (2.0, 8.0)
+SPEECH_MIN_MODULATION_DB = 3.0
+
+
+def syllable_modulation(energy_db: torch.Tensor) -> float:
+    """Standard deviation in dB of a frame energy envelope band-passed to syllable rate."""
+    envelope = energy_db.clamp(min=SPEECH_MIN_ENERGY_DB)
+    envelope = envelope - envelope.mean()
+    spectrum = torch.fft.rfft(envelope)
+    frequencies = torch.fft.rfftfreq(envelope.shape[0], d=FRAME_SECONDS)
+    band = (frequencies >= SYLLABLE_RATE_HZ[0]) & (frequencies <= SYLLABLE_RATE_HZ[1])
+    return float(torch.fft.irfft(spectrum * band, n=envelope.shape[0]).std())
+
+
+def has_speech(audio: torch.Tensor, min_seconds: float, min_modulation_db: float = SPEECH_MIN_MODULATION_DB) -> bool:
+    """
+    Cheap check that a 16 kHz waveform may contain speech, run before the encoder.
+
+    Counts 20 ms frames that are both loud enough and tonal enough (low spectral flatness) to be
+    voiced, and returns True as soon as they add up to min_seconds, so audio with speech is
+    usually accepted after its first 10 s block. Silence and noise are rejected by the frame
+    checks. Music is tonal too, so the voiced frames of a block only count if the energy over the
+    last 10 s also has the syllable-rate modulation of speech, see syllable_modulation;
+    min_modulation_db=0 turns that check off.
+    """
+    num_frames = audio.shape[0] // FRAME_SIZE
+    needed = max(1, int(min_seconds / FRAME_SECONDS))
+    window = torch.hann_window(FRAME_SIZE, dtype=audio.dtype)
+    frames = audio[: num_frames * FRAME_SIZE].view(num_frames, FRAME_SIZE)
+    energy_db = 10 * torch.log10(frames.pow(2).mean(dim=1) + 1e-10)
+
+    voiced = 0
+    for start in range(0, num_frames, GATE_BLOCK_FRAMES):
+        end = min(start + GATE_BLOCK_FRAMES, num_frames)
+        loud = frames[start:end][energy_db[start:end] > SPEECH_MIN_ENERGY_DB]
+        if loud.shape[0] == 0:
+            continue
+
+        power = torch.fft.rfft(loud * window, dim=1).abs().pow(2) + 1e-10
+        flatness = torch.exp(torch.log(power).mean(dim=1)) / power.mean(dim=1)
+        block_voiced = int((flatness < SPEECH_MAX_FLATNESS).sum())
+        if block_voiced == 0:
+            continue
+        # A short last block is judged with the frames before it
+        rhythm = energy_db[max(0, end - GATE_BLOCK_FRAMES) : end]
+        if min_modulation_db > 0 and syllable_modulation(rhythm) < min_modulation_db:
+            continue
+        voiced += block_voiced
+        if voiced >= needed:
+            return True
+    return False
+
+
+def sample_windows(audio: torch.Tensor, budget_seconds: float, window_seconds: float) -> list[torch.Tensor]:
+    """
+    Representative windows of a 16 kHz waveform adding up to budget_seconds: the start, the end
+    and evenly spaced windows between them, in order. The whole waveform if it fits or
+    the budget is not positive.
+    """
+    total = audio.shape[0]
+    if budget_seconds <= 0:
+        return [audio]
+    budget = max(int(budget_seconds * SAMPLE_RATE), 1)
+    if total <= budget:
+        return [audio]
+
+    # At least the start, middle and end, each at most window_seconds and at least a second
+    # long where the budget allows, together spending the whole budget
+    count = max(3, math.ceil(budget / max(int(window_seconds * SAMPLE_RATE), 1)))
+    count = max(1, min(count, budget // SAMPLE_RATE))
+    window = budget // count
+    if count == 1:
+        return [audio[:window]]
+    step = (total - window) / (count - 1)
+    return [audio[round(i * step) : round(i * step) + window] for i in range(count)]
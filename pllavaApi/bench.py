@@ -0,0 +1,235 @@
+"""
+Benchmarks for the PLLaVA service on local videos.
+
+Run inside the container from the directory above the app, e.g.
+    cd $HOME && python -m app.bench pooling --videos clips/*.mp4 --budgets 0 576 1152
+"""
+import argparse
+import re
+import time
+
+import torch
+import torchvision
+from PIL import Image
+from transformers.image_utils import infer_channel_dimension_format
+
+from .utils.eval_utils import conv_templates
+from .utils.model_utils import load_pllava, pllava_answer
+from .utils.models.pllava import PllavaProcessor
+from .utils.video_utils import RESOLUTION, get_index, load_video, probe_size
+
+PROMPT = "Provide a list of keywords describing this video"
+
+
+def load_model(token_budget=None):
+    # The same model main.init_model loads
+    model, processor = load_pllava(
+        repo_id="MODELS/pllava-7b",
+        num_frames=4,
+        use_lora=True,
+        weight_dir="MODELS/pllava-7b",
+        lora_alpha=4,
+        pooling_shape=(16, 12, 12),
+        token_budget=token_budget,
+        use_multi_gpus=False,
+    )
+    return model.to(torch.device(0)).eval(), processor
+
+
+def answer(model, processor, frames) -> str:
+    conv = conv_templates["plain"].copy()
+    conv.user_query(PROMPT, is_mm=True)
+    text, _ = pllava_answer(conv=conv, model=model, processor=processor, do_sample=False,
+                            img_list=frames, max_new_tokens=256, print_res=False)
+    return text
+
+
+def keywords(text: str) -> set:
+    return {word for word in re.split(r"[^\w-]+", text.lower()) if word}
+
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+
+def bench_pooling(args) -> None:
+    model, processor = load_model()
+    projector = model.multi_modal_projector
+    clips = [load_video(path, num_segments=args.num_frames, resolution=RESOLUTION) for path in args.videos]
+    answer(model, processor, clips[0])  # warmup
+
+    print(f"{len(clips)} clips, {args.num_frames} frames each; budget 0 is the fixed pooling shape {tuple(projector.pooling_shape)}")
+    print(f"{'budget':>7} {'prefill tokens':>15} {'prefill, s':>11} {'total, s':>9} {'keyword overlap':>16}")
+    baseline = None
+    for budget in args.budgets:
+        projector.token_budget = budget or None
+        lengths, prefill, total, answers = [], [], [], []
+        for frames in clips:
+            start = time.perf_counter()
+            answers.append(answer(model, processor, frames))
+            total.append(time.perf_counter() - start)
+            lengths.append(model.last_prefill_length)
+            prefill.append(model.last_prefill_seconds)
+
+        baseline = baseline or answers
+        overlap = sum(jaccard(keywords(a), keywords(b)) for a, b in zip(answers, baseline)) / len(answers)
+        print(
+            f"{budget:>7} {sum(lengths) / len(lengths):>15.0f} {sum(prefill) / len(prefill):>11.3f} "
+            f"{sum(total) / len(total):>9.3f} {overlap:>16.2f}"
+        )
+        if args.show_answers:
+            for path, text in zip(args.videos, answers):
+                print(f"  {path}: {text}")
+
+
+def bench_vision(args) -> None:
+    model, _ = load_model()
+    device, dtype = model.device, model.dtype
+    layer = model.config.vision_feature_layer
+    size = model.config.vision_config.image_size
+
+    print(f"vision feature layer {layer}, {size}x{size} frames")
+    print(f"{'frames':>6} {'full, ms':>9} {'truncated, ms':>14} {'full peak, MB':>14} {'truncated peak, MB':>19} {'max abs diff':>13}")
+    for num_frames in args.frames:
+        pixel_values = torch.randn(num_frames, 3, size, size, device=device, dtype=dtype)
+
+        def full():
+            return model.vision_tower(pixel_values, output_hidden_states=True).hidden_states[layer]
+
+        def truncated():
+            return model.get_image_features(pixel_values, layer)
+
+        results = []
+        with torch.no_grad():
+            for fn in (full, truncated):
+                fn()  # warmup
+                torch.cuda.synchronize()
+                torch.cuda.reset_peak_memory_stats()
+                start = time.perf_counter()
+                for _ in range(args.repeats):
+                    output = fn()
+                torch.cuda.synchronize()
+                results.append(((time.perf_counter() - start) / args.repeats, torch.cuda.max_memory_allocated(), output))
+
+        (full_s, full_peak, expected), (truncated_s, truncated_peak, actual) = results
+        diff = (actual.float() - expected.float()).abs().max().item()
+        print(
+            f"{num_frames:>6} {full_s * 1000:>9.1f} {truncated_s * 1000:>14.1f} "
+            f"{full_peak / 2**20:>14.0f} {truncated_peak / 2**20:>19.0f} {diff:>13.2e}"
+        )
+
+
+def load_video_per_frame(video_path, num_segments, resolution):
+    # load_video as it was: every frame seeked and decoded at full resolution, then resized with PIL
+    from decord import VideoReader, cpu
+
+    transforms = torchvision.transforms.Resize(size=resolution)
+    vr = VideoReader(video_path, ctx=cpu(0), num_threads=1)
+    return [transforms(Image.fromarray(vr[index].asnumpy())) for index in get_index(len(vr), num_segments)]
+
+
+def bench_decode(args) -> None:
+    from decord import VideoReader, cpu
+
+    loaders = {
+        "per frame": lambda path, resolution: load_video_per_frame(path, args.num_frames, resolution),
+        "batch": lambda path, resolution: load_video(path, num_segments=args.num_frames, resolution=resolution),
+        "keyframes": lambda path, resolution: load_video(path, num_segments=args.num_frames, resolution=resolution,
+                                                         keyframes=True),
+    }
+    print(f"{args.num_frames} frames per video, mean of {args.repeats} runs")
+    print(f"{'video':<30} {'duration, s':>11} {'source':>10} {'resolution':>10} " + " ".join(f"{name + ', ms':>14}" for name in loaders))
+    for path in args.videos:
+        vr = VideoReader(path, ctx=cpu(0), num_threads=1)
+        height, width = probe_size(path)
+        duration = len(vr) / float(vr.get_avg_fps())
+        del vr
+        for resolution in args.resolutions:
+            timings = []
+            for load in loaders.values():
+                load(path, resolution)  # warmup
+                start = time.perf_counter()
+                for _ in range(args.repeats):
+                    load(path, resolution)
+                timings.append((time.perf_counter() - start) / args.repeats)
+            print(
+                f"{path[-30:]:<30} {duration:>11.1f} {f'{width}x{height}':>10} {resolution:>10} "
+                + " ".join(f"{seconds * 1000:>14.1f}" for seconds in timings)
+            )
+
+
+def bench_preprocess(args) -> None:
+    processor = PllavaProcessor.from_pretrained("MODELS/pllava-7b")
+    device = torch.device(args.device)
+    stages = ("decode", "longshort", "clip", "resize", "normalize")
+
+    print(f"{args.num_frames} frames per video at short side {RESOLUTION}, mean of {args.repeats} runs, "
+          f"normalized on {device} after the copy")
+    print(f"{'video':<30} " + " ".join(f"{stage + ', ms':>13}" for stage in stages) + f" {'max diff':>9} {'mean diff':>10}")
+    for path in args.videos:
+        timings = dict.fromkeys(stages, 0.0)
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            frames = load_video(path, num_segments=args.num_frames, resolution=RESOLUTION)
+            decoded = time.perf_counter()
+            # PllavaProcessor.__call__ for a list of frames, stage by stage
+            cropped = processor.resize_crop_longshort([list(frames)], infer_channel_dimension_format(frames[0]))[0]
+            longshort = time.perf_counter()
+            expected = processor.image_processor(cropped, return_tensors="np")["pixel_values"]
+            clip = time.perf_counter()
+            pixels = processor.resize_video(frames)
+            resized = time.perf_counter()
+            actual = processor.normalize_video(pixels, device)
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+            normalized = time.perf_counter()
+            for stage, seconds in zip(stages, (decoded - start, longshort - decoded, clip - longshort,
+                                               resized - clip, normalized - resized)):
+                timings[stage] += seconds / args.repeats
+
+        # In levels of 255: the pixel values are divided by the CLIP std, about 0.27
+        diff = (actual.cpu() - torch.from_numpy(expected)).abs() * torch.tensor(processor.image_processor.image_std).view(1, 3, 1, 1) * 255
+        print(
+            f"{path[-30:]:<30} " + " ".join(f"{timings[stage] * 1000:>13.1f}" for stage in stages)
+            + f" {diff.max().item():>9.2f} {diff.mean().item():>10.3f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    pooling = subparsers.add_parser("pooling", help="prefill length/latency and answer drift per visual token budget")
+    pooling.add_argument("--videos", nargs="+", required=True, help="local video files, a fixed set to compare runs")
+    pooling.add_argument("--budgets", type=int, nargs="+", default=[0, 576, 1152],
+                         help="visual tokens per video, 0 for the fixed pooling shape (the baseline, run first)")
+    pooling.add_argument("--num-frames", type=int, default=4)
+    pooling.add_argument("--show-answers", action="store_true")
+    pooling.set_defaults(func=bench_pooling)
+
+    vision = subparsers.add_parser("vision", help="full vision tower with all hidden states against the truncated one")
+    vision.add_argument("--frames", type=int, nargs="+", default=[1, 4, 8, 16])
+    vision.add_argument("--repeats", type=int, default=10)
+    vision.set_defaults(func=bench_vision)
+
+    decode = subparsers.add_parser("decode", help="frame extraction latency per video and output resolution")
+    decode.add_argument("--videos", nargs="+", required=True, help="local video files of different durations and sizes")
+    decode.add_argument("--resolutions", type=int, nargs="+", default=[224, RESOLUTION, 720], help="short side of the frames")
+    decode.add_argument("--num-frames", type=int, default=4)
+    decode.add_argument("--repeats", type=int, default=5)
+    decode.set_defaults(func=bench_decode)
+
+    preprocess = subparsers.add_parser("preprocess", help="per-stage latency of the legacy and the fused preprocessing")
+    preprocess.add_argument("--videos", nargs="+", required=True)
+    preprocess.add_argument("--num-frames", type=int, default=4)
+    preprocess.add_argument("--repeats", type=int, default=5)
+    preprocess.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu",
+                            help="where the uint8 pixels are copied to and normalized")
+    preprocess.set_defaults(func=bench_preprocess)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
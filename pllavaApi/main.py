@@ -1,19 +1,17 @@
 import logging
 import os
 import tempfile
-import requests
+import httpx
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from typing import Optional
 
 import torch
-import torchvision
-from PIL import Image
-import numpy as np
-from decord import VideoReader, cpu
 
 from .utils.model_utils import load_pllava, pllava_answer
 from .utils.eval_utils import ChatPllava, conv_templates
+from .utils.scratch_utils import ScratchJob, ScratchSpace
+from .utils.video_utils import RESOLUTION, load_video
 
 app = FastAPI()
 
@@ -32,6 +30,11 @@ class VideoDescriptionResponse(BaseModel):
 # ========================================
 #             Model Initialization
 # ========================================
+# Visual tokens per video. When set, the temporal pooling follows the frames actually sampled and
+# the spatial pooling shrinks below 12x12 only if needed to fit, instead of pooling the 4 frames
+# to 16x12x12 = 2304 tokens. See bench.py pooling for the prefill cost and answer drift.
+TOKEN_BUDGET = int(os.environ.get("PLLAVA_TOKEN_BUDGET", 0)) or None
+
 def init_model():
     logger.info('Initializing PLLaVA')
     model, processor = load_pllava(
@@ -41,6 +44,7 @@ def init_model():
                             weight_dir="MODELS/pllava-7b",
                             lora_alpha=4,
                             pooling_shape=(16,12,12),
+                            token_budget=TOKEN_BUDGET,
                             use_multi_gpus=False)
 
     model = model.to(torch.device(0))
@@ -49,7 +53,27 @@ def init_model():
     logger.info('Model and processor initialized and moved to CUDA')
     return model, processor
 
-RESOLUTION = 360 #
+# Downloaded videos are kept under PLLAVA_SCRATCH_DIR while they are processed, up to
+# PLLAVA_SCRATCH_MAX_MB for all requests together; a request that does not fit waits up to
+# PLLAVA_SCRATCH_WAIT_SECONDS and fails. Videos of at most PLLAVA_SCRATCH_RAM_MAX_MB go to
+# PLLAVA_SCRATCH_RAM_DIR instead when it is set, e.g. to a directory in /dev/shm.
+SCRATCH_DIR = os.environ.get("PLLAVA_SCRATCH_DIR", os.path.join(tempfile.gettempdir(), "pllava"))
+SCRATCH_MAX_MB = float(os.environ.get("PLLAVA_SCRATCH_MAX_MB", 4096))
+SCRATCH_WAIT_SECONDS = float(os.environ.get("PLLAVA_SCRATCH_WAIT_SECONDS", 30))
+SCRATCH_RAM_DIR = os.environ.get("PLLAVA_SCRATCH_RAM_DIR") or None
+SCRATCH_RAM_MAX_MB = float(os.environ.get("PLLAVA_SCRATCH_RAM_MAX_MB", 64))
+CHUNK_SIZE = 1 << 16
+
+scratch = ScratchSpace(
+    SCRATCH_DIR,
+    int(SCRATCH_MAX_MB * 1024 * 1024),
+    SCRATCH_WAIT_SECONDS,
+    ram_directory=SCRATCH_RAM_DIR,
+    ram_max_file_bytes=int(SCRATCH_RAM_MAX_MB * 1024 * 1024),
+)
+scratch.sweep()
+http_client = httpx.AsyncClient(follow_redirects=True, timeout=30)
+
 model, processor = init_model()
 chat = ChatPllava(model, processor)
 INIT_CONVERSATION = conv_templates["plain"]
@@ -61,32 +85,6 @@ Follow the instructions carefully and explain your answers in detail based on th
 
 ################
 
-def get_index(num_frames, num_segments):
-    seg_size = float(num_frames - 1) / num_segments
-    start = int(seg_size / 2)
-    offsets = np.array([
-        start + int(np.round(seg_size * idx)) for idx in range(num_segments)
-    ])
-    return offsets
-
-def load_video(video_path, num_segments=8, return_msg=False, num_frames=4, resolution=336):
-    transforms = torchvision.transforms.Resize(size=resolution)
-    vr = VideoReader(video_path, ctx=cpu(0), num_threads=1)
-    num_frames = len(vr)
-    frame_indices = get_index(num_frames, num_segments)
-    images_group = list()
-    for frame_index in frame_indices:
-        img = Image.fromarray(vr[frame_index].asnumpy())
-        images_group.append(transforms(img))
-    if return_msg:
-        fps = float(vr.get_avg_fps())
-        sec = ", ".join([str(round(f / fps, 1)) for f in frame_indices])
-        # " " should be added in the start and end
-        msg = f"The video contains {len(frame_indices)} frames sampled at {sec} seconds."
-        return images_group, msg
-    else:
-        return images_group
-        
 def infer(model, processor, vid_path, num_frames=4, conv_mode="plain", prompt="Provide a list of keywords describing this video"):
     
     if num_frames != 0:
@@ -106,6 +104,27 @@ def infer(model, processor, vid_path, num_frames=4, conv_mode="plain", prompt="P
     
     return llm_response, conv
 
+async def download(url, job: ScratchJob):
+    async with http_client.stream("GET", url) as response:
+        response.raise_for_status()
+        size = int(response.headers["content-length"]) if "content-length" in response.headers else None
+        video_path = job.path("video", size)
+
+        # The announced size is reserved up front, anything beyond it as it arrives
+        reserved = 0
+        if size:
+            await job.reserve(size)
+            reserved = size
+        written = 0
+        with open(video_path, "wb") as f:
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                written += len(chunk)
+                if written > reserved:
+                    await job.reserve(written - reserved)
+                    reserved = written
+                f.write(chunk)
+    return video_path
+
 #####################
 
 @app.post("/describe", response_model=VideoDescriptionResponse)
@@ -113,22 +132,18 @@ async def describe_video(request: VideoDescriptionRequest):
     try:
         logger.info(f'Received request for URL: {request.url}')
         
-        # Download the video
-        with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-            video_path = tmp_file.name
-            response = requests.get(request.url)
-            tmp_file.write(response.content)
-        
-        # Process the video
-        response = infer(model,
-                        processor,
-                        video_path,
-                        num_frames=4,
-                        conv_mode="plain",
-                        prompt=request.prompt)
-        
-        # Delete the video
-        os.remove(video_path)
+        # The video is deleted when the request ends, whether it succeeds or not
+        async with scratch.job() as job:
+            # Download the video
+            video_path = await download(request.url, job)
+
+            # Process the video
+            response = infer(model,
+                            processor,
+                            video_path,
+                            num_frames=4,
+                            conv_mode="plain",
+                            prompt=request.prompt)
         
         logger.info(response)
         
@@ -1,6 +1,7 @@
 
 import torch
 import os
+import time
 import logging
 from peft import get_peft_model, LoraConfig, TaskType
 from safetensors import safe_open
@@ -44,9 +45,22 @@ class KeywordsStoppingCriteria(StoppingCriteria):
             return flag
 
 
-def load_pllava(repo_id, num_frames, use_lora=False, weight_dir=None, lora_alpha=32, use_multi_gpus=False, pooling_shape=(16,12,12)):
+class FirstTokenTimer(StoppingCriteria):
+    # Called after every generation step, the first call comes right after the prefill
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_token = None
+
+    def __call__(self, output_ids, scores, **kwargs) -> bool:
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        return False
+
+
+def load_pllava(repo_id, num_frames, use_lora=False, weight_dir=None, lora_alpha=32, use_multi_gpus=False, pooling_shape=(16,12,12), token_budget=None):
     kwargs = {
         'num_frames': num_frames,
+        'token_budget': token_budget,
     }
     # print("===============>pooling_shape", pooling_shape)
     if num_frames == 0:
@@ -148,16 +162,22 @@ def pllava_answer(conv: Conversation, model, processor, img_list, do_sample=True
                repetition_penalty=1.0, length_penalty=1, temperature=1.0, stop_criteria_keywords=None, print_res=False):
     # torch.cuda.empty_cache()
     prompt = conv.get_prompt()
-    inputs = processor(text=prompt, images=img_list, return_tensors="pt")
-    if inputs['pixel_values'] is None:
-        inputs.pop('pixel_values')
+    inputs = processor(text=prompt, images=img_list, return_tensors="pt", normalize=False)
+    pixel_values = inputs.pop('pixel_values')
     inputs = inputs.to(model.device)
+    if pixel_values is not None:
+        # A video array stays uint8 until it is on the model device, and is normalized there
+        if pixel_values.dtype == torch.uint8:
+            pixel_values = processor.normalize_video(pixel_values, model.device, model.dtype)
+        inputs['pixel_values'] = pixel_values.to(model.device)
     
     # set up stopping criteria
     if stop_criteria_keywords is not None:
         stopping_criteria = [KeywordsStoppingCriteria(stop_criteria_keywords, processor.tokenizer, inputs["input_ids"])]
     else:
-        stopping_criteria= None
+        stopping_criteria= []
+    timer = FirstTokenTimer()
+    stopping_criteria.append(timer)
 
     with torch.no_grad():
         output_token = model.generate(**inputs, media_type='video',
@@ -165,6 +185,10 @@ def pllava_answer(conv: Conversation, model, processor, img_list, do_sample=True
                                       top_p=top_p, repetition_penalty=repetition_penalty, length_penalty=length_penalty, temperature=temperature, 
                                       stopping_criteria=stopping_criteria,)
         output_text = processor.batch_decode(output_token, skip_special_tokens=True, clean_up_tokenization_spaces=False)[0]
+    finished = time.perf_counter()
+    model.last_prefill_seconds = timer.first_token - timer.start if timer.first_token else None
+    logger.info(f'Prefill: {getattr(model, "last_prefill_length", None)} tokens in {model.last_prefill_seconds or 0:.3f}s, '
+                f'generation: {output_token.shape[1] - inputs["input_ids"].shape[1]} tokens in {finished - (timer.first_token or timer.start):.3f}s')
 
     if print_res: # debug usage
         logger.info('### PROMPTING LM WITH: ', prompt)
@@ -95,6 +95,7 @@ class PllavaConfig(PretrainedConfig):
         num_frames=1, # llava 1.5 pretrained frame shape
         use_pooling=True,
         gradient_checkpointing=False,
+        token_budget=None, # visual tokens per video; derive the pooling shape from the frames instead of pooling_shape
         **kwargs,
     ):
         self.ignore_index = ignore_index
@@ -104,6 +105,7 @@ class PllavaConfig(PretrainedConfig):
         self.vision_feature_layer = vision_feature_layer
         self.vocab_size = vocab_size
         self.use_pooling = use_pooling
+        self.token_budget = token_budget
         self.gradient_checkpointing = gradient_checkpointing
         
         self.vision_config = vision_config
@@ -91,6 +91,15 @@ class PllavaCausalLMOutputWithPast(ModelOutput):
     attentions: Optional[Tuple[torch.FloatTensor]] = None
     image_hidden_states: Optional[Tuple[torch.FloatTensor]] = None
 
+def budget_pooling_shape(num_frames, token_budget, max_spatial_shape):
+    """
+    Pooling shape that keeps every frame and fits num_frames x h x w into token_budget, with h and w
+    at most max_spatial_shape (the spatial shape the projector was trained with), square otherwise.
+    """
+    side = max(1, math.isqrt(max(token_budget // num_frames, 1)))
+    return (num_frames, min(side, max_spatial_shape[0]), min(side, max_spatial_shape[1]))
+
+
 class PllavaMultiModalProjector(nn.Module):
     supported_highres = ['pad_crop_four', 'slide', ]
     def __init__(self, config: PllavaConfig):
@@ -99,6 +108,9 @@ class PllavaMultiModalProjector(nn.Module):
         self.frame_shape=config.frame_shape
         self.num_frames = config.num_frames
         self.pooling_shape = config.pooling_shape
+        # With a token budget, frames are not pooled up to pooling_shape[0] temporal slots (which
+        # repeats each of 4 frames 4 times for (16, 12, 12)), see budget_pooling_shape
+        self.token_budget = getattr(config, 'token_budget', None)
         
         self.pooling = nn.AdaptiveAvgPool3d(config.pooling_shape)
         self.linear_1 = nn.Linear(config.vision_config.hidden_size, config.text_config.hidden_size, bias=True)
@@ -141,7 +153,11 @@ class PllavaMultiModalProjector(nn.Module):
         hidden_states = self.act(hidden_states)
         hidden_states = self.linear_2(hidden_states)
         hidden_states_videos = self.convert_Fembeddings2video(hidden_states, num_videos * batch_size, frame_shape)
-        hidden_states_videos = self.pooling(hidden_states_videos)
+        if self.token_budget:
+            pooling_shape = budget_pooling_shape(hidden_states_videos.shape[2], self.token_budget, self.pooling_shape[1:])
+            hidden_states_videos = nn.functional.adaptive_avg_pool3d(hidden_states_videos, pooling_shape)
+        else:
+            hidden_states_videos = self.pooling(hidden_states_videos)
         hidden_states = einops.rearrange(hidden_states_videos, 'batch_size_num_videos embed_dims num_frames h w -> batch_size_num_videos num_frames (h w) embed_dims', )
         hidden_states = einops.rearrange(hidden_states, 'batch_size_num_videos num_frames hw embed_dims -> batch_size_num_videos (num_frames hw) embed_dims ')
         return hidden_states
@@ -326,6 +342,24 @@ class PllavaForConditionalGeneration(PllavaPreTrainedModel):
         self.vocab_size = model_embeds.num_embeddings
         return model_embeds
 
+    def get_image_features(self, pixel_values, vision_feature_layer):
+        """
+        hidden_states[vision_feature_layer] of the vision tower. For a CLIP tower only the layers up to
+        the selected one are run, and only the current hidden state is kept, instead of running
+        every layer with output_hidden_states=True and keeping all of them.
+        """
+        vision_model = getattr(self.vision_tower, 'vision_model', None)
+        if vision_model is None:
+            return self.vision_tower(pixel_values, output_hidden_states=True).hidden_states[vision_feature_layer]
+
+        # hidden_states[0] is the embedding output, hidden_states[i] the output of layer i
+        num_layers = vision_feature_layer % (len(vision_model.encoder.layers) + 1)
+        hidden_states = vision_model.embeddings(pixel_values)
+        hidden_states = vision_model.pre_layrnorm(hidden_states)
+        for layer in vision_model.encoder.layers[:num_layers]:
+            hidden_states = layer(hidden_states, None, None)[0]
+        return hidden_states
+
     def _merge_input_ids_with_image_features(self, image_features, inputs_embeds, input_ids, attention_mask, labels):
         num_images, num_image_patches, embed_dim = image_features.shape
         batch_size, sequence_length = input_ids.shape
@@ -470,9 +504,7 @@ class PllavaForConditionalGeneration(PllavaPreTrainedModel):
             batch_size = inputs_embeds.shape[0]
             # 2. Merge text and images
             if pixel_values is not None and input_ids.shape[1] != 1:
-                image_outputs = self.vision_tower(pixel_values, output_hidden_states=True)
-                # this is not memory efficient at all (output_hidden_states=True) will save all the hidden stated.
-                selected_image_feature = image_outputs.hidden_states[vision_feature_layer] #  ( b, img_seqlen, embed_dim)
+                selected_image_feature = self.get_image_features(pixel_values, vision_feature_layer) #  ( b, img_seqlen, embed_dim)
                 if vision_feature_select_strategy == "default":
                     selected_image_feature = selected_image_feature[:, 1:]
                 elif vision_feature_select_strategy == "full":
@@ -491,6 +523,8 @@ class PllavaForConditionalGeneration(PllavaPreTrainedModel):
                 inputs_embeds, attention_mask, labels, position_ids = self._merge_input_ids_with_image_features(
                     image_features, inputs_embeds, input_ids, attention_mask, labels
                 )
+                # Reported by pllava_answer
+                self.last_prefill_length = inputs_embeds.shape[1]
                 if labels is None:
                     labels = torch.full_like(attention_mask, self.config.ignore_index).to(torch.long)
             else:
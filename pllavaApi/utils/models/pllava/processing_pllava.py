@@ -21,6 +21,8 @@ import itertools
 from typing import List, Optional, Union
 import PIL.Image
 import numpy as np
+import torch
+import torch.nn.functional as F
 
 from transformers import AutoTokenizer
 from transformers.feature_extraction_utils import BatchFeature
@@ -109,6 +111,52 @@ class PllavaProcessor(ProcessorMixin):
 
         return out_videos
 
+    def preprocess_video(self, frames) -> torch.Tensor:
+        """
+        Pixel values [T, 3, crop, crop] of one video given as uint8 frames [T, H, W, 3], in one pass over
+        the whole clip: resized with the short side at the CLIP resolution, center cropped and normalized
+        as one tensor. Does what resize_crop_longshort and the image processor do frame by frame for a
+        single video (their first resize keeps the aspect ratio and crops nothing), up to resampling
+        differences, so the output matches theirs within a few levels of 255.
+        """
+        return self.normalize_video(self.resize_video(frames))
+
+    def resize_video(self, frames) -> torch.Tensor:
+        """
+        The resize and crop of preprocess_video, as uint8 [T, 3, crop, crop]. The result is in pinned
+        memory when CUDA is available, so that it can be copied to the GPU asynchronously.
+        """
+        image_processor = self.image_processor
+        video = torch.as_tensor(frames).permute(0, 3, 1, 2).float()
+
+        height, width = video.shape[-2:]
+        short = image_processor.size['shortest_edge']
+        size = (short, int(short * width / height)) if height <= width else (int(short * height / width), short)
+        video = F.interpolate(video, size=size, mode='bicubic', align_corners=False, antialias=True)
+        # The image processor resizes to uint8 images
+        video = video.clamp_(0, 255).round_()
+
+        crop_height, crop_width = image_processor.crop_size['height'], image_processor.crop_size['width']
+        top, left = (size[0] - crop_height) // 2, (size[1] - crop_width) // 2
+        video = video[..., top:top + crop_height, left:left + crop_width]
+
+        pixels = torch.empty(video.shape, dtype=torch.uint8, pin_memory=torch.cuda.is_available())
+        return pixels.copy_(video)
+
+    def normalize_video(self, pixels: torch.Tensor, device=None, dtype=torch.float32) -> torch.Tensor:
+        """
+        The normalization of preprocess_video for uint8 pixels from resize_video: they are copied to
+        device as they are, a quarter of the bytes of float32, and scaled, shifted and cast to dtype
+        there by a single addcmul.
+        """
+        image_processor = self.image_processor
+        device = pixels.device if device is None else torch.device(device)
+        mean = torch.tensor(image_processor.image_mean).view(1, 3, 1, 1)
+        std = torch.tensor(image_processor.image_std).view(1, 3, 1, 1)
+        scale = (1 / (255 * std)).to(device=device, dtype=dtype)
+        bias = (-mean / std).to(device=device, dtype=dtype)
+        return torch.addcmul(bias, pixels.to(device, non_blocking=True), scale)
+
     @staticmethod
     def _compute_num_blocks_and_overlaps(input_shape, resolution):
         input_shape = np.array(input_shape)
@@ -181,6 +229,7 @@ class PllavaProcessor(ProcessorMixin):
         truncation: Union[bool, str, TruncationStrategy] = None,
         max_length=None,
         return_tensors: Optional[Union[str, TensorType]] = TensorType.PYTORCH,
+        normalize: bool = True,
     ) -> BatchFeature:
         """
         Main method to prepare for the model one or several sequences(s) and image(s). This method forwards the `text`
@@ -211,6 +260,9 @@ class PllavaProcessor(ProcessorMixin):
                 Maximum length of the returned list and optionally padding length (see above).
             truncation (`bool`, *optional*):
                 Activates truncation to cut input sequences longer than `max_length` to `max_length`.
+            normalize (`bool`, *optional*, defaults to `True`):
+                If `False`, a video given as a uint8 array gets uint8 `pixel_values` from `resize_video`, to be passed
+                through `normalize_video` on the model device.
             return_tensors (`str` or [`~utils.TensorType`], *optional*):
                 If set, will return tensors of a particular framework. Acceptable values are:
 
@@ -229,9 +281,16 @@ class PllavaProcessor(ProcessorMixin):
             - **pixel_values** -- Pixel values to be fed to a model. Returned when `images` is not `None`.
         """
         data=dict()
-        if images is not None:
+        center_pad = center_pad if center_pad is not None else self.center_pad
+        if isinstance(images, np.ndarray) and images.ndim == 4 and images.dtype == np.uint8 and not center_pad:
+            # One video as a [T, H, W, C] array, as load_video returns it
+            pixel_values = self.preprocess_video(images) if normalize else self.resize_video(images)
+            data.update(pixel_values=pixel_values if return_tensors in ('pt', TensorType.PYTORCH) else pixel_values.numpy())
+        elif images is not None:
             if isinstance(images, list) and isinstance(images[0], PIL.Image.Image):
                 videos = [images] # one video
+            elif isinstance(images, np.ndarray) and images.ndim == 4:
+                videos = [list(images)] # one video as a [T, H, W, C] array
             else:
                 videos = images
             
@@ -248,7 +307,6 @@ class PllavaProcessor(ProcessorMixin):
                         "torch.Tensor, tf.Tensor or jax.ndarray."
                     )                
 
-                center_pad = center_pad if center_pad is not None else self.center_pad
                 if center_pad:
                     images = [self.pad_to_square(image, 0, input_data_format, input_data_format) for image in images]
 
@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import os
+import shutil
+import uuid
+from contextlib import asynccontextmanager
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+JOB_PREFIX = "job-"
+
+
+class ScratchQuotaExceeded(RuntimeError):
+    pass
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _start_time(pid: int) -> str:
+    # Start time of the process in clock ticks since boot, field 22 of /proc/<pid>/stat. A PID is
+    # reused, e.g. the server is PID 1 again after a container restart, its start time is not.
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return "0"
+
+
+class ScratchJob:
+    """
+    Files of one request. They live in a directory of their own under the disk root, or under the
+    RAM root for files known to be small, and are removed with it when the request ends.
+    """
+
+    def __init__(self, space: "ScratchSpace", name: str):
+        self.space = space
+        self.name = name
+        self.directories: list[str] = []
+        self.reserved = 0
+
+    def path(self, filename: str, size: Optional[int] = None) -> str:
+        """Where to write filename; size, when known in advance, lets small files go to RAM."""
+        root = self.space.directory
+        if self.space.ram_directory and size is not None and size <= self.space.ram_max_file_bytes:
+            root = self.space.ram_directory
+        directory = os.path.join(root, self.name)
+        if directory not in self.directories:
+            os.makedirs(directory, exist_ok=True)
+            self.directories.append(directory)
+        return os.path.join(directory, filename)
+
+    async def reserve(self, size: int) -> None:
+        await self.space.reserve(size)
+        self.reserved += size
+
+    async def cleanup(self) -> None:
+        for directory in self.directories:
+            shutil.rmtree(directory, ignore_errors=True)
+        self.directories = []
+        await self.space.release(self.reserved)
+        self.reserved = 0
+
+
+class ScratchSpace:
+    """
+    Temporary media files of all requests, under a global byte quota.
+
+    Every request gets a ScratchJob whose directories are removed however the request ends. Writers
+    reserve bytes before writing them; when the quota is used up they wait up to wait_seconds for
+    other requests to finish and then fail with ScratchQuotaExceeded, so a burst of downloads is
+    pushed back instead of filling the disk. Job directories are named after the PID and start time
+    of the process that owns them, and sweep() removes those of processes that are gone, including
+    those of an earlier process that had the same PID.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int,
+        wait_seconds: float,
+        ram_directory: Optional[str] = None,
+        ram_max_file_bytes: int = 0,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.wait_seconds = wait_seconds
+        self.ram_directory = ram_directory
+        self.ram_max_file_bytes = ram_max_file_bytes
+        self.used = 0
+        self._released = asyncio.Condition()
+        self._owner = f"{os.getpid()}-{_start_time(os.getpid())}"
+
+        for root in self.roots:
+            os.makedirs(root, exist_ok=True)
+
+    @property
+    def roots(self) -> list[str]:
+        return [root for root in (self.directory, self.ram_directory) if root]
+
+    def sweep(self) -> int:
+        """Remove job directories left behind by processes that no longer run; returns how many."""
+        removed = 0
+        for root in self.roots:
+            for entry in os.scandir(root):
+                if not entry.name.startswith(JOB_PREFIX):
+                    continue
+                pid, _, rest = entry.name[len(JOB_PREFIX):].partition("-")
+                start_time = rest.split("-", 1)[0]
+                if pid.isdigit() and _pid_alive(int(pid)) and start_time == _start_time(int(pid)):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.remove(entry.path)
+                removed += 1
+        if removed:
+            logger.info(f'Removed {removed} orphaned scratch directories')
+        return removed
+
+    async def reserve(self, size: int) -> None:
+        if size > self.max_bytes:
+            raise ScratchQuotaExceeded(f'{size} bytes exceed the scratch space quota of {self.max_bytes}')
+        async with self._released:
+            try:
+                await asyncio.wait_for(
+                    self._released.wait_for(lambda: self.used + size <= self.max_bytes),
+                    self.wait_seconds,
+                )
+            except asyncio.TimeoutError:
+                raise ScratchQuotaExceeded('Scratch space is full, try again later') from None
+            self.used += size
+
+    async def release(self, size: int) -> None:
+        if not size:
+            return
+        async with self._released:
+            self.used -= size
+            self._released.notify_all()
+
+    @asynccontextmanager
+    async def job(self):
+        job = ScratchJob(self, f"{JOB_PREFIX}{self._owner}-{uuid.uuid4().hex}")
+        try:
+            yield job
+        finally:
+            await job.cleanup()
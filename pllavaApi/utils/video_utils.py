@@ -0,0 +1,73 @@
+import subprocess
+
+import numpy as np
+from decord import VideoReader, cpu
+
+# Short side frames are resized to when they are decoded
+RESOLUTION = 360
+
+
+def get_index(num_frames, num_segments):
+    seg_size = float(num_frames - 1) / num_segments
+    start = int(seg_size / 2)
+    offsets = np.array([
+        start + int(np.round(seg_size * idx)) for idx in range(num_segments)
+    ])
+    return offsets
+
+def snap_to_keyframes(frame_indices, key_indices):
+    """The keyframe nearest to each index, so that no frame after a keyframe has to be decoded."""
+    key_indices = np.asarray(key_indices)
+    if len(key_indices) == 0:
+        return frame_indices
+    positions = np.searchsorted(key_indices, frame_indices)
+    before = key_indices[np.clip(positions - 1, 0, len(key_indices) - 1)]
+    after = key_indices[np.clip(positions, 0, len(key_indices) - 1)]
+    return np.where(np.abs(frame_indices - before) <= np.abs(after - frame_indices), before, after)
+
+def probe_size(video_path):
+    """(height, width) of the first video stream, read by ffprobe from the headers without decoding."""
+    output = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=width,height",
+         "-of", "csv=p=0:s=x", video_path],
+        capture_output=True, text=True, check=True,
+    ).stdout.split()
+    if not output:
+        raise ValueError(f"No video stream in {video_path}")
+    width, height = (int(value) for value in output[0].split("x")[:2])
+    return height, width
+
+def target_size(height, width, resolution):
+    """(height, width) with the short side scaled to resolution, as torchvision's Resize(resolution) computes it."""
+    if height <= width:
+        return resolution, int(resolution * width / height)
+    return int(resolution * height / width), resolution
+
+def load_video(video_path, num_segments=8, return_msg=False, num_frames=4, resolution=336, keyframes=False):
+    """
+    num_segments frames of the video as one uint8 array [T, H, W, 3], short side scaled to resolution.
+
+    The decoder scales the frames itself, so full resolution frames are never converted, and all of
+    them are fetched with one get_batch over sorted indices: each GOP is decoded once going forward
+    instead of seeking back to a keyframe for every frame. With keyframes=True the indices are moved
+    to the nearest keyframes, which only need their own packet decoded.
+    """
+    # The source size comes from the headers, so the file is indexed by one reader that scales
+    height, width = probe_size(video_path)
+    out_height, out_width = target_size(height, width, resolution)
+    vr = VideoReader(video_path, ctx=cpu(0), num_threads=1, width=out_width, height=out_height)
+    num_frames = len(vr)
+    frame_indices = get_index(num_frames, num_segments)
+    if keyframes:
+        frame_indices = snap_to_keyframes(frame_indices, vr.get_key_indices())
+    order = np.argsort(frame_indices, kind="stable")
+    images_group = np.empty((len(frame_indices), out_height, out_width, 3), dtype=np.uint8)
+    images_group[order] = vr.get_batch(frame_indices[order].tolist()).asnumpy()
+    if return_msg:
+        fps = float(vr.get_avg_fps())
+        sec = ", ".join([str(round(f / fps, 1)) for f in frame_indices])
+        # " " should be added in the start and end
+        msg = f"The video contains {len(frame_indices)} frames sampled at {sec} seconds."
+        return images_group, msg
+    else:
+        return images_group